@@ -0,0 +1,38 @@
+# Redundant Sensor Project
+#
+# Fuses the readings of redundant temperature, humidity and light sensors with
+## Marzullo's Algorithm and raises alerts for archive storage conditions.
+#
+# The modules are imported on first use, so importing the package is instant
+## and a tool only pays for what it touches, e.g.
+#
+#   import redundant_sensor
+#   redundant_sensor.marzullo.marzulloSweep(intervals, len(intervals), 0)
+#
+# Running the sensor fusion loop:
+##  python3 sensor_fusion.py (in the project folder)
+##  python3 -m redundant_sensor
+
+import importlib
+
+# Modules of the package, loaded by __getattr__ when first used
+_MODULES = ["acquisition", "benchmark", "binlog", "collector", "config",
+    "hardware", "leds", "log_writer", "marzullo", "metrics", "rawlog", "replay",
+    "runtime", "scheduler", "sensor_fusion", "thresholds", "timing", "trace",
+    "windows"]
+
+
+def __getattr__(name):
+    if name in _MODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
+
+
+# Runs the sensor fusion loop, see sensor_fusion.main()
+def main():
+    from .sensor_fusion import main
+    main()
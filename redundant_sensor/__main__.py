@@ -0,0 +1,5 @@
+# Runs the sensor fusion loop: python3 -m redundant_sensor
+
+from . import main
+
+main()
@@ -0,0 +1,196 @@
+# Concurrent Sensor Series Acquisition
+#
+# Reads every sensor series through a pool of worker threads, one worker per
+## I2C bus. Series that share a bus (and so share the MUX) are read one after
+## another by that bus's worker, since only one MUX channel can be open on a
+## bus at a time. Series on different buses are read in parallel.
+# Each series is given a deadline. A series on a bus gets its own slot of
+## 'timeout' seconds after the slots of the series queued ahead of it on the
+## same bus, so a quick read leaves more time for the ones behind it. A series
+## that isn't read by its deadline is reported as down instead of holding up
+## the rest of the cycle.
+# Given a batch read, the series queued on a bus are read by one call instead
+## of one call each (see SensorBackend.readSeriesBatch), so their HTU31D
+## conversions overlap. The batch is given the slots of all its series. It
+## hands back each series' readings as soon as that series is read, so if it
+## isn't finished by then (or fails) the series already read are kept and only
+## the rest are reported as down.
+# A read that hangs can't be interrupted, so its bus is treated as busy until
+## the read finally returns. Series on a busy bus are reported as down straight
+## away rather than being queued up behind it.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from . import trace
+
+# Readings reported for a series that is down
+## temperature, relative_humidity, lux, up_down (1 = down)
+SERIES_DOWN = (0, 0, 0, 1)
+
+
+# Reads sensor series concurrently, with a deadline on each series
+## read = function taking a series, returning the series readings as
+##        (temperature, relative_humidity, lux, up_down)
+## timeout = seconds allowed for each series read
+## read_batch = function taking a list of series on the same bus and a list
+##              of the same size, which it fills with each series' readings
+##              as it goes. None to read each series on its own
+class SeriesAcquirer:
+
+    def __init__(self, read, timeout, read_batch=None):
+        self.read = read
+        self.timeout = timeout
+        self.read_batch = read_batch
+        # One single-thread worker per I2C bus
+        self.workers = {}
+        # Tasks queued on each bus that haven't finished yet, used to spot a
+        ## bus that is still stuck on a read from an earlier cycle
+        self.pending = {}
+
+    # Returns the worker for an I2C bus, creating it on first use
+    def _worker(self, bus):
+        if bus not in self.workers:
+            self.workers[bus] = ThreadPoolExecutor(max_workers=1,
+                thread_name_prefix="i2c-bus-%s" % bus)
+        return self.workers[bus]
+
+    # Returns True if the bus is still busy with an earlier task
+    def busy(self, bus):
+        if bus not in self.pending:
+            return False
+        self.pending[bus] = [task for task in self.pending[bus] if not task.done()]
+        return len(self.pending[bus]) > 0
+
+    # Queues a function on a bus's worker without waiting for it, e.g. for
+    ## MUX housekeeping that must not overlap a series read
+    ## bus = the I2C bus the function talks to
+    ## fn = function to run, followed by its arguments
+    def run(self, bus, fn, *args):
+        task = self._worker(bus).submit(fn, *args)
+        if bus not in self.pending:
+            self.pending[bus] = []
+        self.pending[bus].append(task)
+        return task
+
+    # Reads a list of sensor series
+    # Returns a list of readings in the same order as the series
+    ## series = list of SensorSeries (see config.py)
+    def acquire(self, series):
+        if self.read_batch is not None:
+            return self.acquireBatches(series)
+        start = time.monotonic()
+        tasks = []
+        deadlines = []
+        queued = {}
+
+        for s in series:
+            bus = s.bus
+            if self.busy(bus) and bus not in queued:
+                _busy(bus, s)
+                tasks.append(None)
+                deadlines.append(None)
+                continue
+            if bus not in queued:
+                queued[bus] = 0
+            queued[bus] = queued[bus] + 1
+            tasks.append(self.run(bus, self.read, s))
+            deadlines.append(start + queued[bus] * self.timeout)
+
+        readings = []
+        for x in range(0,len(series)):
+            task = tasks[x]
+            if task is None:
+                readings.append(SERIES_DOWN)
+                continue
+            try:
+                readings.append(task.result(timeout=max(0, deadlines[x] - time.monotonic())))
+            except FutureTimeout:
+                _timedOut(series[x])
+                # Dropping the read if it hasn't started yet
+                task.cancel()
+                readings.append(SERIES_DOWN)
+            except Exception as error:
+                _failed(error, [series[x]])
+                readings.append(SERIES_DOWN)
+
+        return readings
+
+    # Reads a list of sensor series, one batch per I2C bus
+    # Returns a list of readings in the same order as the series
+    ## series = list of SensorSeries (see config.py)
+    def acquireBatches(self, series):
+        start = time.monotonic()
+        readings = [SERIES_DOWN] * len(series)
+        # Positions in 'series' of the series on each bus
+        batches = {}
+        for x in range(0,len(series)):
+            if series[x].bus not in batches:
+                batches[series[x].bus] = []
+            batches[series[x].bus].append(x)
+
+        tasks = {}
+        # Readings of each bus's series, filled in by the batch as it goes
+        results = {}
+        for bus in batches:
+            if self.busy(bus):
+                for x in batches[bus]:
+                    _busy(bus, series[x])
+                continue
+            results[bus] = [None] * len(batches[bus])
+            tasks[bus] = self.run(bus, self.read_batch, [series[x] for x in batches[bus]],
+                results[bus])
+
+        for bus in tasks:
+            task = tasks[bus]
+            deadline = start + len(batches[bus]) * self.timeout
+            error = None
+            try:
+                task.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeout:
+                # Dropping the read if it hasn't started yet
+                task.cancel()
+            except Exception as failure:
+                error = failure
+            # Copied now, as a hung batch may still fill in more later
+            batch = list(results[bus])
+            unread = []
+            for x in range(0,len(batch)):
+                if batch[x] is not None:
+                    readings[batches[bus][x]] = batch[x]
+                elif error is None:
+                    _timedOut(series[batches[bus][x]])
+                else:
+                    unread.append(series[batches[bus][x]])
+            if unread:
+                _failed(error, unread)
+
+        return readings
+
+    # Stops the bus workers. A read that is hung is left to finish on its own.
+    def shutdown(self):
+        for tasks in self.pending.values():
+            for task in tasks:
+                task.cancel()
+        for worker in self.workers.values():
+            worker.shutdown(wait=False)
+
+
+# Trace events for series that couldn't be read
+def _busy(bus, series):
+    if trace.level <= trace.WARN:
+        trace.event(trace.WARN, "acquire", "I2C bus %s is still busy, %s skipped" %
+            (bus, series), bus=bus, series=series.number)
+
+
+def _timedOut(series):
+    if trace.level <= trace.WARN:
+        trace.event(trace.WARN, "acquire", "%s timed out" % series,
+            series=series.number)
+
+
+def _failed(error, series):
+    if trace.level <= trace.WARN:
+        trace.event(trace.WARN, "acquire", "\t%s" % error, error=str(error),
+            series=[s.number for s in series])
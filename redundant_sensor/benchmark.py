@@ -0,0 +1,398 @@
+# Benchmark Suite for the Sensor Fusion Loop
+#
+# Times each stage of the sensor fusion loop using simulated sensor readings,
+## so no hardware is needed. Four sets of benchmarks are run:
+#   stage    - every loop stage, per cycle, for each number of sensor series
+#   fusion   - Marzullo's Algorithm as a plain sweep and as a MarzulloTracker,
+#              for each number of sensor series, with a share of the readings
+#              changing each cycle (--changed)
+#   window   - the humidity change check and Lux Hours total at each loop
+#              rate, since the hour window holds more readings at faster rates
+#   log      - the CSV and binary log writers at each log volume (rows written)
+#
+# Results are written as JSON, one result per line, with timings in
+## microseconds. Passing a previous results file with --compare checks every
+## matching result against it and exits with status 1 if any mean time has
+## grown by more than --tolerance, so slower cycles are caught before a new
+## version is deployed.
+#
+# Usage:
+##  python3 -m redundant_sensor.benchmark
+##  python3 -m redundant_sensor.benchmark --series 3,8,64 --cycles 500 --output bench.json
+##  python3 -m redundant_sensor.benchmark --compare bench.json --tolerance 0.25
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from . import sensor_fusion
+from . import log_writer
+from . import trace
+from .acquisition import SeriesAcquirer
+from .config import SensorSeries
+from .hardware import SimBackend
+from .leds import LedBank
+from .marzullo import marzulloSweep, MarzulloTracker
+from .thresholds import ThresholdTable
+from .log_writer import LogWriter
+from .binlog import BinaryLogWriter
+
+
+# Returns the summary of a list of timings (nanoseconds) in microseconds
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+
+    def pct(p):
+        return samples[min(n - 1, int(p * n))] / 1000
+
+    return {
+        "samples": n,
+        "mean_us": sum(samples) / n / 1000,
+        "p50_us": pct(0.50),
+        "p95_us": pct(0.95),
+        "p99_us": pct(0.99),
+        "max_us": samples[-1] / 1000,
+    }
+
+
+# Returns N simulated series, 8 to each MUX address and 64 (all 8 MUX
+## addresses) to each I2C bus, so every series is one a configuration file
+## could hold
+## The first series keep the LEDs of the configured series, the rest have none
+def makeSeries(N):
+    configured = sensor_fusion.series_list
+    series_list = []
+    for x in range(N):
+        s = SensorSeries(x + 1, 0x70 + (x // 8) % 8, x % 8, bus=1 + x // 64)
+        if x < len(configured):
+            s.led_error = configured[x].led_error
+            s.led_down = configured[x].led_down
+        series_list.append(s)
+    return series_list
+
+
+# Resets the loop state in sensor_fusion for a run with N series
+def resetLoop(N, directory):
+    sensor_fusion.series_list = makeSeries(N)
+    sensor_fusion.led_list = sensor_fusion.ledList(sensor_fusion.series_list)
+    sensor_fusion.alert_table = ThresholdTable(
+        sensor_fusion.alertRules(sensor_fusion.series_list),
+        sensor_fusion.alertInputs(sensor_fusion.series_list))
+    sensor_fusion.sensor_error = [0] * N
+    sensor_fusion.sensor_down = [0] * N
+    sensor_fusion.lux_hours.clear()
+    sensor_fusion.hum_over_hour.clear()
+    for tracker in sensor_fusion.fusion_trackers:
+        tracker.reset()
+    sensor_fusion.backend = SimBackend(seed=N)
+    sensor_fusion.led_bank = LedBank(sensor_fusion.backend, sensor_fusion.led_list)
+    sensor_fusion.led_bank.setup()
+    sensor_fusion.log = LogWriter(directory=directory,
+        flush_rows=sensor_fusion.log_flush_rows,
+        flush_interval=sensor_fusion.log_flush_interval,
+        headers=log_writer.logHeaders(N, len(sensor_fusion.led_list)))
+
+
+# Times every loop stage for each cycle, with N simulated series
+## N = number of sensor series
+## cycles = number of loop cycles to time
+## period = simulated seconds between cycles
+def benchStages(N, cycles, period, directory):
+    resetLoop(N, directory)
+    backend = sensor_fusion.backend
+    acquirer = SeriesAcquirer(backend.readSeries, sensor_fusion.series_timeout,
+        backend.readSeriesBatch if sensor_fusion.batch_reads == 1 else None)
+    series = sensor_fusion.series_list
+    stages = ["acquire", "read", "marzullo", "luxhours", "humidity", "led",
+        "log", "cycle"]
+    times = {}
+    for stage in stages:
+        times[stage] = []
+
+    clock = time.perf_counter_ns
+    now = time.time()
+    for x in range(cycles):
+        now = now + period
+
+        t0 = clock()
+        readings = acquirer.acquire(series)
+        t1 = clock()
+        temp_intervals, hum_intervals, lux_intervals = sensor_fusion.readStage(readings)
+        t2 = clock()
+        lowL, highL, medianL, luxMA = sensor_fusion.fuseStage(lux_intervals, 2)
+        lowT, highT, medianT, tempMA = sensor_fusion.fuseStage(temp_intervals, 0)
+        lowH, highH, medianH, humMA = sensor_fusion.fuseStage(hum_intervals, 1)
+        t3 = clock()
+        luxHRs = sensor_fusion.luxHoursStage(now, medianL)
+        t4 = clock()
+        hum_changed = sensor_fusion.humidityStage(now, medianH)
+        t5 = clock()
+        led_state = sensor_fusion.ledStage(now, lowT, highT, lowH, highH, lowL, highL,
+            luxHRs, hum_changed)
+        t6 = clock()
+        sensor_fusion.logStage(datetime.fromtimestamp(now), medianT, medianH,
+            medianL, luxHRs, led_state)
+        t7 = clock()
+
+        times["acquire"].append(t1 - t0)
+        times["read"].append(t2 - t1)
+        times["marzullo"].append(t3 - t2)
+        times["luxhours"].append(t4 - t3)
+        times["humidity"].append(t5 - t4)
+        times["led"].append(t6 - t5)
+        times["log"].append(t7 - t6)
+        times["cycle"].append(t7 - t0)
+
+    acquirer.shutdown()
+    sensor_fusion.log.close()
+
+    results = []
+    for stage in stages:
+        result = {"benchmark": "stage", "stage": stage, "series": N}
+        result.update(summarize(times[stage]))
+        if stage == "led":
+            # LED pins written per cycle, after the initial setup
+            result["pin_writes"] = backend.led_writes / cycles
+        results.append(result)
+    return results
+
+
+# Times Marzullo's Algorithm on N temperature ranges, fused from scratch by
+## marzulloSweep and incrementally by a MarzulloTracker
+# Readings start around 21 C and each cycle a share of them move by a small
+## step, rounded to 0.01 like the real readings.
+## N = number of sensor series
+## cycles = number of timed cycles
+## changed = share of the readings (0-1) that change each cycle
+def benchFusion(N, cycles, changed):
+    rng = random.Random(N)
+    temps = [round(rng.gauss(21, 0.2), 2) for x in range(N)]
+    cycle_intervals = []
+    for x in range(cycles):
+        for y in range(N):
+            if rng.random() < changed:
+                temps[y] = round(temps[y] + rng.gauss(0, 0.02), 2)
+        cycle_intervals.append([[t - 0.2, t + 0.2] for t in temps])
+
+    clock = time.perf_counter_ns
+    tracker = MarzulloTracker(0)
+    times = {"sweep": [], "tracker": []}
+    for intervals in cycle_intervals:
+        t0 = clock()
+        marzulloSweep(intervals, N, 0)
+        t1 = clock()
+        tracker.fuse(intervals)
+        t2 = clock()
+        times["sweep"].append(t1 - t0)
+        times["tracker"].append(t2 - t1)
+
+    results = []
+    for stage in ["sweep", "tracker"]:
+        result = {"benchmark": "fusion", "stage": stage, "series": N,
+            "changed": changed}
+        result.update(summarize(times[stage]))
+        if stage == "tracker":
+            # Share of cycles where the saved endpoints were patched
+            result["patched"] = tracker.patched / cycles
+        results.append(result)
+    return results
+
+
+# Times the humidity change check and Lux Hours total with a full hour
+## window of readings at the given loop period
+## period = seconds between cycles
+## cycles = number of timed cycles
+def benchWindows(period, cycles, directory):
+    resetLoop(3, directory)
+    now = time.time()
+
+    # Filling the hour window before timing
+    for x in range(int(sensor_fusion.hum_window / period)):
+        now = now + period
+        sensor_fusion.humidityStage(now, 45.0)
+        sensor_fusion.luxHoursStage(now, 150.0)
+
+    clock = time.perf_counter_ns
+    times = {"humidity": [], "luxhours": []}
+    for x in range(cycles):
+        now = now + period
+        t0 = clock()
+        sensor_fusion.humidityStage(now, 45.0 + (x % 10) / 10)
+        t1 = clock()
+        sensor_fusion.luxHoursStage(now, 150.0)
+        t2 = clock()
+        times["humidity"].append(t1 - t0)
+        times["luxhours"].append(t2 - t1)
+    sensor_fusion.log.close()
+
+    results = []
+    for stage in ["humidity", "luxhours"]:
+        result = {"benchmark": "window", "stage": stage, "period_s": period,
+            "window_len": int(sensor_fusion.hum_window / period)}
+        result.update(summarize(times[stage]))
+        results.append(result)
+    return results
+
+
+# Times the log writer for a given number of rows
+## rows = number of rows written
+def benchLog(rows, directory):
+    row = [datetime.now().strftime("%b-%d-%Y"), "12:00:00.000000", 21.0, 45.0,
+        150.0, 1000.0, "Up", "Up", "Up"] + ["0"] * 17
+    writer = LogWriter(directory=directory,
+        flush_rows=sensor_fusion.log_flush_rows,
+        flush_interval=sensor_fusion.log_flush_interval)
+
+    clock = time.perf_counter_ns
+    times = []
+    start = clock()
+    for x in range(rows):
+        t0 = clock()
+        writer.write(row)
+        times.append(clock() - t0)
+    t0 = clock()
+    writer.close()
+    close_ns = clock() - t0
+    total_ns = clock() - start
+
+    result = {"benchmark": "log", "stage": "log", "rows": rows,
+        "rows_per_s": rows / (total_ns / 1e9), "close_us": close_ns / 1000,
+        "bytes_per_row": os.path.getsize(writer.path) / rows}
+    result.update(summarize(times))
+    return [result, benchBinaryLog(rows, directory)]
+
+
+# Times the binary log writer for a given number of rows
+## rows = number of rows written
+def benchBinaryLog(rows, directory):
+    now = datetime.now()
+    writer = BinaryLogWriter(3, 17, prefix="binary_log_", directory=directory,
+        flush_rows=sensor_fusion.log_flush_rows,
+        flush_interval=sensor_fusion.log_flush_interval)
+
+    clock = time.perf_counter_ns
+    times = []
+    start = clock()
+    for x in range(rows):
+        t0 = clock()
+        writer.write(now, 21.0, 45.0, 150.0, 1000.0, 0, 0)
+        times.append(clock() - t0)
+    t0 = clock()
+    writer.close()
+    close_ns = clock() - t0
+    total_ns = clock() - start
+
+    result = {"benchmark": "log", "stage": "binlog", "rows": rows,
+        "rows_per_s": rows / (total_ns / 1e9), "close_us": close_ns / 1000,
+        "bytes_per_row": os.path.getsize(writer.path) / rows}
+    result.update(summarize(times))
+    return result
+
+
+# Returns the key that matches a result to the same result in another run
+def resultKey(result):
+    return (result["benchmark"], result["stage"], result.get("series"),
+        result.get("changed"), result.get("period_s"), result.get("rows"))
+
+
+# Compares results against a baseline file
+# Returns a list of messages, one for each result that got slower
+## tolerance = allowed growth in mean time, as a fraction (0.2 = 20%)
+def compare(results, baseline_path, tolerance):
+    baseline = {}
+    with open(baseline_path) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                baseline[resultKey(result)] = result
+
+    regressions = []
+    for result in results:
+        old = baseline.get(resultKey(result))
+        if old is None or old["mean_us"] <= 0:
+            continue
+        growth = result["mean_us"] / old["mean_us"] - 1
+        if growth > tolerance:
+            label = ["%s=%s" % (name, result[name]) for name in
+                ("series", "changed", "period_s", "rows") if name in result]
+            regressions.append("%s %s %s: %0.1f us -> %0.1f us (+%0.0f%%)" % (
+                result["benchmark"], result["stage"], " ".join(label),
+                old["mean_us"], result["mean_us"], growth * 100))
+    return regressions
+
+
+def parseList(text, kind):
+    return [kind(x) for x in text.split(",") if x]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sensor fusion loop stages")
+    parser.add_argument("--series", default="3,8,64,512",
+        help="comma separated numbers of sensor series (default: 3,8,64,512)")
+    parser.add_argument("--cycles", type=int, default=200,
+        help="timed cycles per run (default: 200)")
+    parser.add_argument("--changed", default="0.02,0.2,1",
+        help="comma separated shares of readings changing each cycle for the fusion benchmarks")
+    parser.add_argument("--periods", default="60,5,1,0.1",
+        help="comma separated loop periods in seconds for the window benchmarks")
+    parser.add_argument("--log-rows", default="1000,10000",
+        help="comma separated row counts for the log benchmarks")
+    parser.add_argument("--output", help="file to write results to (default: stdout)")
+    parser.add_argument("--compare", help="baseline results file to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+        help="allowed growth in mean time before failing --compare (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    # Benchmarks run quietly
+    sensor_fusion.debug = 0
+    trace.close()
+
+    # The configured series only lend their LEDs to the simulated ones, so a
+    ## missing or broken configuration file doesn't stop the benchmarks
+    try:
+        sensor_fusion.loadConfig()
+    except (OSError, ValueError) as error:
+        print("Sensor series not loaded, simulated series have no LEDs: %s" % error,
+            file=sys.stderr)
+
+    directory = tempfile.mkdtemp(prefix="sensor_bench_")
+    results = []
+    try:
+        for N in parseList(args.series, int):
+            results.extend(benchStages(N, args.cycles,
+                sensor_fusion.loop_period, directory))
+        for N in parseList(args.series, int):
+            for changed in parseList(args.changed, float):
+                results.extend(benchFusion(N, args.cycles, changed))
+        for period in parseList(args.periods, float):
+            results.extend(benchWindows(period, args.cycles, directory))
+        for rows in parseList(args.log_rows, int):
+            results.extend(benchLog(rows, directory))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    lines = "".join(json.dumps(result) + "\n" for result in results)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(lines)
+    else:
+        sys.stdout.write(lines)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for message in regressions:
+            print("Regression: " + message, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+# Binary Log Format
+#
+# A compact alternative to the CSV log, written alongside it. Each cycle is one
+## fixed-width record:
+#
+#   time         float64   seconds since the epoch
+#   temperature  float32   fused temperature (C)
+#   humidity     float32   fused relative humidity (%)
+#   lux          float32   fused lux
+#   lux_hours    float32   cumulative lux hours
+#   series       uint8[]   bitmask of series down, bit x for series x + 1
+#   leds         uint8[]   bitmask of LED states, bit x for LED x + 1
+#
+# A 16 byte header at the start of each file gives the number of series and
+## LEDs, which sets the width of the two bitmasks. With 3 series and 17 LEDs a
+## record is 28 bytes, against about 95 bytes for the same row of CSV text.
+# Files are append-only and rotate at midnight like the CSV log, with the same
+## name but a .bin extension. readLog() memory-maps a day file straight into a
+## NumPy structured array, and toCSV() converts one back to the CSV layout
+## written by log_writer.py.
+#
+# Converting a file from the command line:
+#   python3 -m redundant_sensor.binlog sensor_log_Oct-18-2026.bin [-o output.csv]
+
+import argparse
+import atexit
+import csv
+import os
+import struct
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .log_writer import logHeaders
+from . import trace
+
+# File header: magic string, series count, LED count
+_MAGIC = b"RSPLOG1\n"
+_HEADER = struct.Struct("<8sHH4x")
+
+
+# Returns the record dtype for a number of series and LEDs
+def recordType(series_count, led_count):
+    return np.dtype([("time", "<f8"), ("temperature", "<f4"),
+        ("humidity", "<f4"), ("lux", "<f4"), ("lux_hours", "<f4"),
+        ("series", "u1", (-(-series_count // 8),)),
+        ("leds", "u1", (-(-led_count // 8),))])
+
+
+# Expands bitmask bytes into one 0/1 column per bit
+## masks = array of shape (records, bytes)
+## count = number of bits in use
+def unpackMasks(masks, count):
+    bits = (masks[:, :, None] >> np.arange(8, dtype=np.uint8)) & 1
+    return bits.reshape(len(masks), -1)[:, :count]
+
+
+# Reads the header of a binary log file
+# Returns series_count, led_count
+# Raises ValueError if the file isn't a binary log
+def readHeader(path):
+    with open(path, "rb") as f:
+        data = f.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        raise ValueError("%s: too short to be a binary log" % path)
+    magic, series_count, led_count = _HEADER.unpack(data)
+    if magic != _MAGIC:
+        raise ValueError("%s: not a binary log" % path)
+    return series_count, led_count
+
+
+# Memory-maps a binary log file as a NumPy structured array
+# A partly written record at the end of the file is left out
+# Returns records, series_count, led_count
+## path = path to the binary log file
+def readLog(path):
+    series_count, led_count = readHeader(path)
+    dtype = recordType(series_count, led_count)
+    count = (os.path.getsize(path) - _HEADER.size) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype), series_count, led_count
+    records = np.memmap(path, dtype=dtype, mode="r", offset=_HEADER.size,
+        shape=(count,))
+    return records, series_count, led_count
+
+
+# Converts a binary log file to the CSV log layout
+## path = path to the binary log file
+## csv_path = path of the CSV file to write, defaults to path with
+##            _converted.csv, so it is never the day's own CSV log (which has
+##            the same name as the binary log, with .csv)
+## overwrite = True to replace csv_path if it already exists
+# Raises FileExistsError if csv_path exists and overwrite is False
+def toCSV(path, csv_path=None, overwrite=False):
+    if csv_path is None:
+        csv_path = os.path.splitext(path)[0] + "_converted.csv"
+    records, series_count, led_count = readLog(path)
+    series = unpackMasks(records["series"], series_count)
+    leds = unpackMasks(records["leds"], led_count)
+
+    # Mode "x" fails if the file exists, without a gap between checking and
+    ## creating it
+    with open(csv_path, "w" if overwrite else "x", newline="") as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(logHeaders(series_count, led_count))
+        for x in range(0,len(records)):
+            dateTimeObj = datetime.fromtimestamp(records["time"][x])
+            row = [dateTimeObj.strftime("%b-%d-%Y"),
+                dateTimeObj.strftime("%H:%M:%S.%f")]
+            for field in ["temperature", "humidity", "lux", "lux_hours"]:
+                row.append(round(float(records[field][x]), 2))
+            row = row + ["Down" if bit else "Up" for bit in series[x]]
+            row = row + [int(bit) for bit in leds[x]]
+            csvwriter.writerow(row)
+    return csv_path
+
+
+# Writes records to a daily binary log file
+## series_count = number of sensor series
+## led_count = number of LEDs
+## prefix = start of the log file name, followed by the date
+## flush_rows = number of buffered records that triggers a write to disk
+## flush_interval = max seconds a record may wait in the buffer
+## directory = folder the log files are kept in
+class BinaryLogWriter:
+
+    def __init__(self, series_count, led_count, prefix="sensor_log_",
+        flush_rows=10, flush_interval=60, directory="."):
+        self.series_count = series_count
+        self.led_count = led_count
+        self.prefix = prefix
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.directory = directory
+        self.dtype = recordType(series_count, led_count)
+        # Records are packed with struct as they come in, matching the dtype
+        self.series_bytes = self.dtype["series"].shape[0]
+        self.led_bytes = self.dtype["leds"].shape[0]
+        self.record = struct.Struct("<d4f%ds%ds" % (self.series_bytes, self.led_bytes))
+
+        self.path = None
+        self.file = None
+        self.rotate_at = None
+        self.rows = []
+        self.last_flush = time.monotonic()
+
+        atexit.register(self.close)
+
+    # Opens (or creates) the log file for the day of 'now' and works out when
+    ## the next rotation is due
+    # If the day's file was written with a different number of series or LEDs,
+    ## a numbered file is used instead
+    def _open(self, now):
+        currentDate = now.strftime("%b-%d-%Y")
+        name = self.prefix + currentDate
+        self.path = os.path.join(self.directory, name + ".bin")
+        n = 1
+        while (os.path.exists(self.path) and os.path.getsize(self.path) > 0 and
+            readHeader(self.path) != (self.series_count, self.led_count)):
+            self.path = os.path.join(self.directory, "%s_%d.bin" % (name, n))
+            n = n + 1
+
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, "ab")
+        if new_file:
+            if trace.level <= trace.INFO:
+                trace.event(trace.INFO, "log", "Creating "+self.path, path=self.path)
+            self.file.write(_HEADER.pack(_MAGIC, self.series_count, self.led_count))
+        else:
+            # Dropping a partly written record left by a crash
+            size = os.path.getsize(self.path)
+            extra = (size - _HEADER.size) % self.dtype.itemsize
+            if extra != 0:
+                self.file.truncate(size - extra)
+
+        self.rotate_at = datetime.combine(now.date() + timedelta(days=1),
+            datetime.min.time())
+
+    # Writes any buffered records to the open file and flushes it to disk
+    def flush(self):
+        if self.file is None:
+            return
+        if self.rows:
+            self.file.write(b"".join(self.rows))
+            self.rows = []
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    # Queues a record for the log file of the day it was recorded on
+    ## now = datetime the record was taken at
+    ## temperature, humidity, lux, lux_hours = fused values
+    ## series_down = bit vector of the series that are down
+    ## led_state = bit vector of the LED states
+    def write(self, now, temperature, humidity, lux, lux_hours, series_down,
+        led_state):
+        # Rotating to a new file at midnight
+        if self.file is None or now >= self.rotate_at:
+            self.close()
+            self._open(now)
+
+        self.rows.append(self.record.pack(now.timestamp(), temperature,
+            humidity, lux, lux_hours, series_down.to_bytes(self.series_bytes, "little"),
+            led_state.to_bytes(self.led_bytes, "little")))
+
+        if (len(self.rows) >= self.flush_rows or
+            time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    # Flushes any buffered records and closes the current log file
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts binary sensor logs to CSV")
+    parser.add_argument("paths", nargs="+", help="binary log files")
+    parser.add_argument("-o", "--output",
+        help="CSV file to write (one input only), defaults to the input name with _converted.csv")
+    parser.add_argument("-f", "--force", action="store_true",
+        help="overwrite CSV files that already exist")
+    args = parser.parse_args()
+
+    if args.output is not None and len(args.paths) > 1:
+        parser.error("--output can only be used with a single input file")
+    for path in args.paths:
+        try:
+            print(toCSV(path, args.output, args.force))
+        except FileExistsError as error:
+            parser.exit(1, "%s already exists, use --force to overwrite it\n" % error.filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,489 @@
+# Multi-Site Collector
+#
+# Brings the readings of many sensor_fusion.py nodes (one per archive room)
+## together on one server. Each node sends its fused ranges, Lux Hours, series
+## status and LED states in batches, the collector stores them in an indexed
+## SQLite table and fuses the rooms together with Marzullo's Algorithm.
+#
+# Protocol: newline-delimited JSON over TCP. Every request is one line and
+## gets one line back.
+#
+#   {"node": "room-1", "records": [{"time": 1790000000.0,
+#     "temperature": [20.9, 21.1], "humidity": [44.0, 46.0],
+#     "lux": [140.0, 160.0], "lux_hours": 850.0, "series_down": 0,
+#     "leds": 0}, ...]}
+#   -> {"ok": 1}                 (number of records accepted)
+#
+## A quantity none of a node's series could read is sent as [null, null] and
+## left out of the site-wide fusion. Records that can't be stored are left out
+## of the count, and a request that isn't understood at all gets
+## {"error": "..."} back.
+#
+#   {"query": "site"}
+#   -> {"nodes": 12, "temperature": {"low": .., "high": .., "support": ..},
+#       "humidity": {...}, "lux": {...}}
+#
+#   {"query": "latest"}
+#   -> {"room-1": {record}, ...}
+#
+# The server runs on asyncio, so hundreds of nodes can stay connected at once.
+## Records are buffered and written to SQLite in one transaction per flush, on
+## a separate thread so the event loop never waits on the disk.
+#
+# Running the collector:
+#   python3 -m redundant_sensor.collector --port 9600 --db collector.db
+# A node sends to it when SENSOR_COLLECTOR is set (host:port), see
+## sensor_fusion.py.
+
+import argparse
+import asyncio
+import json
+import math
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .marzullo import marzulloBatch
+from . import trace
+
+# Default TCP port of the collector
+DEFAULT_PORT = 9600
+
+# Quantities carried in each record, as fused ranges
+QUANTITIES = ["temperature", "humidity", "lux"]
+
+# Longest request line accepted, in bytes
+_LINE_LIMIT = 4 * 1024 * 1024
+
+# Largest bit vector (series_down, leds) SQLite can store as an INTEGER
+_MAX_BITS = 2 ** 63 - 1
+
+
+# Time-series store for the node records
+## path = SQLite database file (":memory:" for a temporary store)
+class CollectorStore:
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS readings (
+            node TEXT NOT NULL, time REAL NOT NULL,
+            temp_low REAL, temp_high REAL, hum_low REAL, hum_high REAL,
+            lux_low REAL, lux_high REAL, lux_hours REAL,
+            series_down INTEGER, leds INTEGER)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS readings_node_time ON readings (node, time)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS readings_time ON readings (time)")
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    # Writes a batch of rows in one transaction
+    # If the batch can't be written, each row is written on its own, so one
+    ## bad row is the only one lost
+    # Returns the number of rows written
+    ## rows = list of (node, record) pairs
+    def insert(self, rows):
+        values = []
+        for node, record in rows:
+            values.append((node, record["time"],
+                record["temperature"][0], record["temperature"][1],
+                record["humidity"][0], record["humidity"][1],
+                record["lux"][0], record["lux"][1], record.get("lux_hours"),
+                record.get("series_down", 0), record.get("leds", 0)))
+        sql = "INSERT INTO readings VALUES (?,?,?,?,?,?,?,?,?,?,?)"
+        with self.lock:
+            try:
+                with self.db:
+                    self.db.executemany(sql, values)
+                return len(values)
+            except (sqlite3.Error, OverflowError):
+                pass
+            stored = 0
+            for x in range(0,len(values)):
+                try:
+                    with self.db:
+                        self.db.execute(sql, values[x])
+                    stored = stored + 1
+                except (sqlite3.Error, OverflowError) as error:
+                    if trace.level <= trace.WARN:
+                        trace.event(trace.WARN, "collector", "\t%s: record not stored: %s" %
+                            (rows[x][0], error), node=rows[x][0], error=str(error))
+            return stored
+
+    # Returns the records of a node between two times, oldest first
+    ## node = node name, None for every node
+    ## start, end = epoch seconds
+    def query(self, node=None, start=0, end=float("inf")):
+        sql = "SELECT * FROM readings WHERE time >= ? AND time <= ?"
+        args = [start, end]
+        if node is not None:
+            sql = sql + " AND node = ?"
+            args.append(node)
+        with self.lock:
+            return self.db.execute(sql + " ORDER BY time", args).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# Fuses the latest record of each node into site-wide ranges
+# Returns a dict with the number of nodes and, for each quantity, the fused
+## low, high and the number of nodes that agree on it
+## latest = dict of node name to its latest record
+def fuseRooms(latest):
+    records = list(latest.values())
+    site = {"nodes": len(records)}
+    if not records:
+        for name in QUANTITIES:
+            site[name] = {"low": None, "high": None, "support": 0}
+        return site
+
+    # (quantity, node, 2) intervals, fused in one call. Missing ranges become
+    ## NaN, which marzulloBatch leaves out
+    intervals = np.array([[r[name] for r in records] for name in QUANTITIES],
+        dtype=float)
+    low, high, support = marzulloBatch(intervals)
+    for x in range(0,len(QUANTITIES)):
+        if support[x] > 0:
+            site[QUANTITIES[x]] = {"low": float(low[x]), "high": float(high[x]),
+                "support": int(support[x])}
+        else:
+            site[QUANTITIES[x]] = {"low": None, "high": None, "support": 0}
+    return site
+
+
+# Returns True if a JSON value is a number (true/false aren't)
+def _isNumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# Returns True if a JSON value is a finite number (json.loads also accepts
+## NaN and Infinity)
+def _isFinite(value):
+    return _isNumber(value) and math.isfinite(value)
+
+
+# Checks a record from a node, raises ValueError if it can't be stored
+def checkRecord(record):
+    if not isinstance(record, dict):
+        raise ValueError("record is not an object")
+    if not _isFinite(record.get("time")):
+        raise ValueError("record has no time")
+    lux_hours = record.get("lux_hours")
+    if lux_hours is not None and not _isFinite(lux_hours):
+        raise ValueError("record lux_hours is not a number")
+    for name in ("series_down", "leds"):
+        value = record.get(name, 0)
+        if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= _MAX_BITS:
+            raise ValueError("record %s is not a bit vector" % name)
+    for name in QUANTITIES:
+        value = record.get(name)
+        if not isinstance(value, list) or len(value) != 2:
+            raise ValueError("record %s is not a [low, high] pair" % name)
+        for bound in value:
+            if bound is not None and not _isNumber(bound):
+                raise ValueError("record %s is not a [low, high] pair" % name)
+
+
+# The collector service
+## store = CollectorStore the records are written to
+## stale = seconds after which a node's latest record is left out of the
+##         site-wide fusion. A record dated more than this far ahead of the
+##         collector's clock is stored, but doesn't become the node's latest
+##         (it would hide the node's real records until that time).
+## flush_rows = number of buffered records that triggers a write
+## flush_interval = max seconds a record may wait in the buffer
+class Collector:
+
+    def __init__(self, store, stale=120, flush_rows=1000, flush_interval=1):
+        self.store = store
+        self.stale = stale
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self.latest = {}
+        self.pending = []
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="collector-db")
+        self.flushing = None
+        self.server = None
+        self.received = 0
+
+    # Handles one request line, returns the reply
+    def handle(self, request):
+        if not isinstance(request, dict):
+            return {"error": "expected a JSON object"}
+        if "query" in request:
+            if request["query"] == "site":
+                return fuseRooms(self.fresh())
+            if request["query"] == "latest":
+                return self.latest
+            return {"error": "unknown query %s" % request["query"]}
+
+        node = request.get("node")
+        records = request.get("records")
+        if not isinstance(node, str) or not isinstance(records, list):
+            return {"error": "expected node and records"}
+        accepted = 0
+        now = time.time()
+        for record in records:
+            try:
+                checkRecord(record)
+            except ValueError as error:
+                if trace.level <= trace.WARN:
+                    trace.event(trace.WARN, "collector", "\t%s: %s" % (node, error),
+                        node=node, error=str(error))
+                continue
+            self.pending.append((node, record))
+            if record["time"] - now > self.stale:
+                if trace.level <= trace.WARN:
+                    trace.event(trace.WARN, "collector", "\t%s: record dated %.0f s ahead" %
+                        (node, record["time"] - now), node=node, time=record["time"])
+            else:
+                previous = self.latest.get(node)
+                if previous is None or record["time"] >= previous["time"]:
+                    self.latest[node] = record
+            accepted = accepted + 1
+        self.received = self.received + accepted
+        if len(self.pending) >= self.flush_rows:
+            self.flush()
+        return {"ok": accepted}
+
+    # Latest record of each node that has reported within 'stale' seconds
+    def fresh(self):
+        now = time.time()
+        return dict((node, record) for node, record in self.latest.items()
+            if now - record["time"] <= self.stale)
+
+    # Hands the buffered records to the database thread
+    def flush(self):
+        if not self.pending:
+            return
+        rows = self.pending
+        self.pending = []
+        self.flushing = asyncio.get_event_loop().run_in_executor(self.writer,
+            self.store.insert, rows)
+        self.flushing.add_done_callback(self._flushed)
+
+    # Reports a write that failed, which would otherwise only be seen by
+    ## stop() (and only for the last write)
+    def _flushed(self, flushing):
+        if flushing.cancelled() or flushing.exception() is None:
+            return
+        error = flushing.exception()
+        if trace.level <= trace.ERROR:
+            trace.event(trace.ERROR, "collector", "\tRecords not stored: %s" % error,
+                error=str(error))
+
+    # Reads request lines from one node connection until it closes
+    async def client(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        if trace.level <= trace.INFO:
+            trace.event(trace.INFO, "collector", "Node connected from %s" % (peer,),
+                peer=str(peer))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The rest of the line can't be told apart from the next
+                    ## request, so the connection is closed
+                    writer.write((json.dumps({"error": "request longer than %d bytes" %
+                        _LINE_LIMIT}) + "\n").encode())
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                try:
+                    reply = self.handle(json.loads(line))
+                except ValueError as error:
+                    reply = {"error": str(error)}
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as error:
+            if trace.level <= trace.WARN:
+                trace.event(trace.WARN, "collector", "\t%s" % error, peer=str(peer),
+                    error=str(error))
+        finally:
+            writer.close()
+
+    # Flushes the buffer every flush_interval seconds
+    async def flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    # Starts listening, returns once the server is up
+    async def start(self, host="0.0.0.0", port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.client, host, port,
+            limit=_LINE_LIMIT)
+        self.flush_task = asyncio.ensure_future(self.flusher())
+        return self.server
+
+    # Stops the server and writes out anything still buffered
+    async def stop(self):
+        self.flush_task.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        self.flush()
+        if self.flushing is not None:
+            await self.flushing
+        self.writer.shutdown(wait=True)
+
+
+# Sends this node's records to a collector from a background thread, so the
+## sampling loop never waits on the network
+# Records are queued and sent in batches. While the collector can't be reached
+## they are kept, up to 'backlog' records (oldest dropped first), and sent once
+## it's back.
+## address = "host:port" of the collector
+## node = name of this node, defaults to the host name
+## batch_size = records sent per request
+## backlog = most records kept while the collector can't be reached
+## timeout = seconds allowed for connecting and each reply
+class CollectorClient:
+
+    def __init__(self, address, node=None, batch_size=10, backlog=10000, timeout=5):
+        host, _, port = address.rpartition(":")
+        self.host = host or "localhost"
+        self.port = int(port) if port else DEFAULT_PORT
+        self.node = node or socket.gethostname()
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+        self.queue = deque(maxlen=backlog)
+        self.ready = threading.Condition()
+        self.running = True
+        self.sock = None
+        self.sent = 0
+        # Records the collector refused to store
+        self.rejected = 0
+        self.thread = threading.Thread(target=self._run, name="collector-client", daemon=True)
+        self.thread.start()
+
+    # Queues one cycle's record
+    ## now = epoch seconds of the cycle
+    ## ranges = (low, high) for temperature, humidity and lux
+    ## lux_hours = Cumulative Lux Hours
+    ## series_down = bit vector of the series that are down
+    ## leds = LED state bit vector
+    def send(self, now, ranges, lux_hours, series_down, leds):
+        record = {"time": now, "lux_hours": lux_hours,
+            "series_down": series_down, "leds": leds}
+        for x in range(0,len(QUANTITIES)):
+            record[QUANTITIES[x]] = [ranges[x][0], ranges[x][1]]
+        with self.ready:
+            self.queue.append(record)
+            self.ready.notify()
+
+    # Sends one batch, returns once the collector has acknowledged it
+    # Records the collector refused are counted and reported, not sent again,
+    ## as they would only be refused again
+    def _post(self, batch):
+        if self.sock is None:
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+            self.reply = self.sock.makefile("rb")
+        line = json.dumps({"node": self.node, "records": batch}) + "\n"
+        self.sock.sendall(line.encode())
+        reply = self.reply.readline()
+        if not reply:
+            raise ConnectionError("collector closed the connection")
+        try:
+            reply = json.loads(reply)
+            accepted = reply["ok"] if "error" not in reply else 0
+        except (ValueError, TypeError, KeyError):
+            raise ConnectionError("collector sent an unexpected reply")
+        if accepted < len(batch):
+            self.rejected = self.rejected + len(batch) - accepted
+            if trace.level <= trace.WARN:
+                trace.event(trace.WARN, "collector", "\tCollector %s:%d refused %d of %d records: %s" %
+                    (self.host, self.port, len(batch) - accepted, len(batch),
+                    reply.get("error", "invalid records")),
+                    refused=len(batch) - accepted, error=reply.get("error"))
+
+    def _run(self):
+        delay = 1
+        while True:
+            with self.ready:
+                while self.running and not self.queue:
+                    self.ready.wait()
+                if not self.queue:
+                    return
+                batch = [self.queue[x] for x in range(min(self.batch_size, len(self.queue)))]
+            try:
+                self._post(batch)
+            except OSError as error:
+                if trace.level <= trace.WARN:
+                    trace.event(trace.WARN, "collector", "\tCollector %s:%d: %s" %
+                        (self.host, self.port, error), error=str(error))
+                self._disconnect()
+                # Waiting a little longer after each failure, up to a minute.
+                ## New records wake the condition too, so the wait runs to
+                ## its deadline unless the client is closed.
+                retry = time.monotonic() + delay
+                with self.ready:
+                    while self.running and time.monotonic() < retry:
+                        self.ready.wait(retry - time.monotonic())
+                    if not self.running:
+                        return
+                delay = min(delay * 2, 60)
+                continue
+            delay = 1
+            with self.ready:
+                # Records dropped from a full backlog may have shifted the queue
+                for record in batch:
+                    if self.queue and self.queue[0] is record:
+                        self.queue.popleft()
+            self.sent = self.sent + len(batch)
+
+    def _disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    # Sends what is queued (waiting at most 'timeout' seconds) and stops
+    def close(self, timeout=2):
+        with self.ready:
+            self.running = False
+            self.ready.notify()
+        self.thread.join(timeout)
+        self._disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collects readings from many sensor fusion nodes")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+        help="TCP port (default: %d)" % DEFAULT_PORT)
+    parser.add_argument("--db", default="collector.db", help="SQLite database file")
+    parser.add_argument("--stale", type=float, default=120,
+        help="seconds before a silent node is left out of the site fusion")
+    parser.add_argument("--trace", default="warn", choices=list(trace.LEVELS),
+        help="print trace events at this level and above (default: warn)")
+    args = parser.parse_args()
+
+    trace.configure(args.trace, console=True)
+
+    store = CollectorStore(args.db)
+    collector = Collector(store, stale=args.stale)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(collector.start(args.host, args.port))
+    print("Collector listening on %s:%d" % (args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        print("\n")
+    finally:
+        loop.run_until_complete(collector.stop())
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# Sensor Series Configuration
+#
+# The set of sensor series read by sensor_fusion.py is loaded from a JSON file
+## (series.json by default) rather than being written into the script. Each
+## series is a pair of sensors behind one channel of a TCA9548A MUX:
+#
+#   {"series": [
+#     {"address": "0x70", "channel": 0, "sensors": ["htu31d", "ltr390"],
+#      "precision": {"temperature": 0.2, "humidity": 2.0, "lux": 0.1},
+#      "led_error": 25, "led_down": 10},
+#     ...
+#   ]}
+#
+# address = I2C address of the MUX, 0x70 up to 0x77
+# channel = MUX channel the series is on, 0-7
+# bus = I2C bus the MUX is on, as in /dev/i2c-<bus> (optional, defaults to 1).
+##      Each bus has its own MUXes, so the same address and channel can be
+##      used once on every bus.
+# sensors = sensors fitted to the series, any of "htu31d" (temperature and
+##          humidity) and "ltr390" (lux). Defaults to both.
+# precision = known precision of the sensors, +/- degrees C, +/- % relative
+##            humidity, and +/- a fraction of the lux reading. Defaults to the
+##            HTU31D and LTR390 datasheet values.
+# led_error, led_down = GPIO pins of the LEDs showing the series is down this
+##                      cycle, and has been down for 3 or more cycles
+##                      (optional, a series can have no LEDs). Each pin can
+##                      only drive one LED, so it can't be used twice or be
+##                      one of the fixed alert LED pins.
+#
+# Up to 8 MUXes with 8 channels each can be used on each bus, 64 series per bus.
+
+import json
+
+#The name of this device
+_DEFAULT_NAME = "Qwiic Mux"
+_AVAILABLE_I2C_ADDRESS = [*range(0x70,0x77 + 1)]
+_AVAILABLE_CHANNELS = [*range(0,8)]
+
+# Sensor types that can be fitted to a series
+SENSOR_TYPES = ["htu31d", "ltr390"]
+
+# Default precision of each sensor type
+## HTU31D: +/- 0.2 C, +/- 2% RH. LTR390: +/- 10% of the reading
+DEFAULT_PRECISION = {"temperature": 0.2, "humidity": 2.0, "lux": 0.1}
+
+
+# One sensor series: the sensors behind one MUX channel
+## number = series number, starting at 1, used in the log and messages
+class SensorSeries:
+
+    def __init__(self, number, address, channel, bus=1, sensors=SENSOR_TYPES,
+        precision=DEFAULT_PRECISION, led_error=None, led_down=None):
+        self.number = number
+        self.address = address
+        self.channel = channel
+        self.bus = bus
+        self.sensors = list(sensors)
+        self.temp_precision = precision.get("temperature", DEFAULT_PRECISION["temperature"])
+        self.hum_precision = precision.get("humidity", DEFAULT_PRECISION["humidity"])
+        self.lux_precision = precision.get("lux", DEFAULT_PRECISION["lux"])
+        self.led_error = led_error
+        self.led_down = led_down
+
+    # True if the series has a temperature/humidity sensor
+    @property
+    def has_htu(self):
+        return "htu31d" in self.sensors
+
+    # True if the series has a lux sensor
+    @property
+    def has_ltr(self):
+        return "ltr390" in self.sensors
+
+    def __str__(self):
+        return "Series %d (0x%02x channel %d)" % (self.number, self.address, self.channel)
+
+
+# Reads an address written either as a number or as a string like "0x70"
+def _address(value):
+    if isinstance(value, str):
+        return int(value, 0)
+    return int(value)
+
+
+# Loads and checks the sensor series from a JSON configuration file
+# Returns a list of SensorSeries, in the order they appear in the file
+# Raises ValueError if the configuration isn't valid
+## path = path to the configuration file
+## reserved_pins = GPIO pins already used by other LEDs (the fixed alert LEDs),
+##                 which the series LEDs can't use
+def loadSeries(path, reserved_pins=()):
+    with open(path) as f:
+        data = json.load(f)
+
+    if not isinstance(data, dict) or not isinstance(data.get("series", []), list):
+        raise ValueError("%s: expected an object with a \"series\" list" % path)
+    entries = data.get("series", [])
+    if len(entries) == 0:
+        raise ValueError("%s: no sensor series configured" % path)
+
+    series_list = []
+    used = set()
+    pins = set(reserved_pins)
+    for x in range(0,len(entries)):
+        entry = entries[x]
+        if not isinstance(entry, dict):
+            raise ValueError("%s: series %d: expected an object" % (path, x + 1))
+        if "channel" not in entry:
+            raise ValueError("%s: series %d: no MUX channel given" % (path, x + 1))
+        try:
+            address = _address(entry.get("address", _AVAILABLE_I2C_ADDRESS[0]))
+            channel = int(entry["channel"])
+            bus = int(entry.get("bus", 1))
+        except (TypeError, ValueError):
+            raise ValueError("%s: series %d: address, channel and bus must be numbers" % (path, x + 1))
+        sensors = entry.get("sensors", SENSOR_TYPES)
+        precision = entry.get("precision", DEFAULT_PRECISION)
+
+        if address not in _AVAILABLE_I2C_ADDRESS:
+            raise ValueError("%s: series %d: MUX address 0x%02x not in 0x70-0x77" % (path, x + 1, address))
+        if channel not in _AVAILABLE_CHANNELS:
+            raise ValueError("%s: series %d: MUX channel %d not in 0-7" % (path, x + 1, channel))
+        if bus < 0:
+            raise ValueError("%s: series %d: I2C bus %d not valid" % (path, x + 1, bus))
+        if (bus, address, channel) in used:
+            raise ValueError("%s: series %d: bus %d 0x%02x channel %d is used twice" % (path, x + 1,
+                bus, address, channel))
+        if not isinstance(sensors, list) or len(sensors) == 0:
+            raise ValueError("%s: series %d: no sensors fitted" % (path, x + 1))
+        for sensor in sensors:
+            if sensor not in SENSOR_TYPES:
+                raise ValueError("%s: series %d: unknown sensor type %s" % (path, x + 1, sensor))
+        if not isinstance(precision, dict):
+            raise ValueError("%s: series %d: precision must be an object" % (path, x + 1))
+        for key in precision:
+            if key not in DEFAULT_PRECISION:
+                raise ValueError("%s: series %d: unknown precision %s" % (path, x + 1, key))
+            value = precision[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not value >= 0:
+                raise ValueError("%s: series %d: %s precision must be a number >= 0" % (path, x + 1, key))
+        used.add((bus, address, channel))
+        for key in ("led_error", "led_down"):
+            pin = entry.get(key)
+            if pin is None:
+                continue
+            if pin in pins:
+                raise ValueError("%s: series %d: %s GPIO pin %s is already used by another LED" % (path, x + 1, key, pin))
+            pins.add(pin)
+
+        series_list.append(SensorSeries(x + 1, address, channel, bus=bus,
+            sensors=sensors, precision=precision,
+            led_error=entry.get("led_error"), led_down=entry.get("led_down")))
+
+    return series_list
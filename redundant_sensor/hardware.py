@@ -0,0 +1,590 @@
+# Hardware Backends
+#
+# Everything the sensor fusion loop needs from the hardware goes through a
+## backend object: switching MUX channels, reading the HTU31D (temperature and
+## humidity) and LTR390 (lux) sensors, and driving the alert LEDs.
+#
+# PiBackend talks to the real hardware on the Raspberry Pi. The hardware
+## libraries (qwiic, board, the Adafruit drivers and RPi.GPIO) are only imported
+## when a PiBackend is created, so this module can be imported anywhere.
+# SimBackend is an in-process stand-in with configurable noise, latency and
+## dropouts. It supports any number of channels, so the fusion pipeline can be
+## run and load-tested on a plain Linux box.
+#
+# Each MUX is identified by its I2C address (0x70 - 0x77) and the I2C bus it
+## is on, so channels are given as an (address, chan) pair and a bus (1 unless
+## given). Every bus has its own MUXes and sensors, so the same address and
+## channel can be used on each of them.
+# A sensor that can't be reached or read raises OSError from readHTU/readLTR.
+# Series on the same bus are read together with readSeriesBatch(), which starts
+## every HTU31D conversion before collecting any, so the series wait for one
+## conversion between them instead of one each.
+
+import random
+import time
+
+from . import timing
+from . import trace
+
+# LED output states
+HIGH = 1
+LOW = 0
+
+# HTU31D commands and conversion time (both values at the resolution the
+## Adafruit driver leaves it at, the driver waits the same 20 ms)
+_HTU31D_CONVERSION = 0x40
+_HTU31D_READTEMPHUM = 0x00
+_HTU31D_CONVERSION_TIME = 0.02
+
+# LTR390 ALS data register (3 bytes, 20 bits, least significant byte first)
+_LTR390_ALS_DATA = 0x0D
+# LTR390 gain, and integration time as a multiple of 100 ms, for each value
+## of the gain and resolution registers (datasheet)
+_LTR390_GAIN = [1, 3, 6, 9, 18]
+_LTR390_INTEGRATION = [4, 2, 1, 0.5, 0.25, 0.125]
+
+
+# Interface shared by all backends
+class SensorBackend:
+
+    # Enables channel 'chan' of the MUX at 'address' on 'bus'
+    def enableChannel(self, address, chan, bus=1):
+        raise NotImplementedError
+
+    # Disables channel 'chan' of the MUX at 'address' on 'bus'
+    def disableChannel(self, address, chan, bus=1):
+        raise NotImplementedError
+
+    # Disables every channel of the MUXes at 'addresses' (all MUXes if None) on
+    ## 'bus' (all buses if None)
+    def disableAll(self, addresses=None, bus=None):
+        raise NotImplementedError
+
+    # Seconds an HTU31D conversion takes, from startHTU() until collectHTU()
+    ## can read it. 0 for backends that convert inside readHTU().
+    conversion_time = 0
+
+    # Reads the HTU31D on the enabled channel
+    # Returns temperature (C), relative humidity (%)
+    def readHTU(self, address, chan, bus=1):
+        raise NotImplementedError
+
+    # Starts a temperature and humidity conversion on the HTU31D on the
+    ## enabled channel, read back by collectHTU() once conversion_time has passed
+    # Backends that convert inside readHTU() leave this as it is
+    def startHTU(self, address, chan, bus=1):
+        pass
+
+    # Reads the conversion started by startHTU() on the enabled channel
+    # Returns temperature (C), relative humidity (%)
+    def collectHTU(self, address, chan, bus=1):
+        return self.readHTU(address, chan, bus)
+
+    # Reads the LTR390 on the enabled channel
+    # Returns lux
+    def readLTR(self, address, chan, bus=1):
+        raise NotImplementedError
+
+    # Sets up the LED pins as outputs, all off
+    ## pins = list of LED GPIO pins
+    def ledSetup(self, pins):
+        raise NotImplementedError
+
+    # Sets a single LED pin to HIGH or LOW
+    def ledOutput(self, pin, state):
+        raise NotImplementedError
+
+    # Sets several LED pins at once
+    ## pins = list of LED GPIO pins
+    ## states = HIGH or LOW for each pin
+    # Backends that can write a whole bank in one call override this
+    def ledWrite(self, pins, states):
+        for x in range(0,len(pins)):
+            self.ledOutput(pins[x], states[x])
+
+    # Turns all LEDs off and releases the pins
+    def ledCleanup(self, pins):
+        raise NotImplementedError
+
+    # Function to handle i2c communication and read in data from Sensors
+    # MUX channel is enabled, Data is read from the sensors then returned, MUX
+    ## channel is disabled
+    # Readings for a sensor type the series doesn't have are returned as None.
+    ## If any sensor in the series is down, the whole series is treated as
+    ## down and its readings are returned as 0
+    # Returns temperature, relative_humidity, lux, up_down (1 = down)
+    ## series = the SensorSeries to read (see config.py)
+    # With stage timing on, the MUX switching and each sensor read are timed
+    ## as "series<N>.mux", "series<N>.htu" and "series<N>.ltr"
+    def readSeries(self, series):
+        return self.readSeriesBatch([series])[0]
+
+    # Reads several series that share a bus, overlapping their HTU31D
+    ## conversions:
+    ##   1st pass, each series in turn: enable its channel, start the HTU31D
+    ##            conversion, disable the channel
+    ##   2nd pass, in the same order: wait until the series' conversion is
+    ##            done, enable its channel, collect the HTU31D result, read the
+    ##            LTR390, disable the channel
+    ## The series started first is collected first, so it has had the longest
+    ## to convert and only the first one is likely to be waited on. A single
+    ## series keeps its channel enabled between the passes.
+    # Each series is finished in turn by the 2nd pass, and its readings are put
+    ## in 'results' straight away. A caller that stops waiting on a hung read
+    ## (see acquisition.py) keeps the series finished before it. Any error
+    ## reading a series, including from the MUX, only marks that series down.
+    # Returns a list of readings, as readSeries() returns them, in the same
+    ## order as the series
+    ## series_list = list of SensorSeries on the same bus
+    ## results = list the size of series_list to put the readings in, as each
+    ##           series is finished
+    def readSeriesBatch(self, series_list, results=None):
+        single = len(series_list) == 1
+        reads = [_SeriesRead(series) for series in series_list]
+        if results is None:
+            results = [None] * len(series_list)
+
+        for read in reads:
+            series = read.series
+            if not series.has_htu:
+                continue
+            try:
+                self._switch(read, True)
+                try:
+                    start = time.perf_counter()
+                    self.startHTU(series.address, series.channel, series.bus)
+                    read.started = time.perf_counter()
+                    read.htu = read.started - start
+                finally:
+                    if not single:
+                        self._switch(read, False)
+            except Exception as error:
+                read.error = error
+
+        for x in range(0,len(reads)):
+            read = reads[x]
+            series = read.series
+            if read.error is None:
+                if read.started is not None:
+                    wait = read.started + self.conversion_time - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                try:
+                    if not single or not series.has_htu:
+                        self._switch(read, True)
+                    try:
+                        if read.started is not None:
+                            start = time.perf_counter()
+                            temperature, relative_humidity = self.collectHTU(series.address,
+                                series.channel, series.bus)
+                            read.htu = read.htu + time.perf_counter() - start
+                            read.temperature = round(temperature, 2)
+                            read.relative_humidity = round(relative_humidity, 2)
+                        if series.has_ltr:
+                            start = time.perf_counter()
+                            read.lux = round(self.readLTR(series.address, series.channel, series.bus), 2)
+                            if read.timed:
+                                timing.record(read.name + "ltr", time.perf_counter() - start)
+                    finally:
+                        self._switch(read, False)
+                except Exception as error:
+                    read.error = error
+            elif single:
+                try:
+                    self._switch(read, False)
+                except Exception:
+                    pass
+            results[x] = self._readings(read)
+
+        return results
+
+    # Enables (True) or disables (False) the MUX channel of a series being read
+    def _switch(self, read, enable):
+        if read.timed:
+            start = time.perf_counter()
+        if enable:
+            self.enableChannel(read.series.address, read.series.channel, read.series.bus)
+        else:
+            self.disableChannel(read.series.address, read.series.channel, read.series.bus)
+        if read.timed:
+            read.mux = read.mux + time.perf_counter() - start
+
+    # Returns temperature, relative_humidity, lux, up_down (1 = down) of a
+    ## series that has been read, 0s if any of its sensors failed
+    def _readings(self, read):
+        series = read.series
+        if read.timed:
+            timing.record(read.name + "mux", read.mux)
+            if read.started is not None and read.error is None:
+                timing.record(read.name + "htu", read.htu)
+
+        if read.error is not None:
+            if trace.level <= trace.WARN:
+                trace.event(trace.WARN, "read", "\t%s\n\n%s Down" % (read.error, series),
+                    series=series.number, error=str(read.error))
+            return 0, 0, 0, 1
+
+        if trace.level <= trace.DEBUG:
+            # Sensor Readings for Debugging Purposes
+            lines = ["\n%s has the following readings: " % series]
+            if read.temperature is not None:
+                lines.append("\tTemperature: %0.1f C" % read.temperature)
+                lines.append("\tHumidity: %0.1f%%" % read.relative_humidity)
+            if read.lux is not None:
+                lines.append("\tLux: %0.1f" % read.lux)
+            trace.event(trace.DEBUG, "read", "\n".join(lines), series=series.number,
+                temperature=read.temperature, humidity=read.relative_humidity,
+                lux=read.lux)
+
+        # Return Sensor Readings
+        return read.temperature, read.relative_humidity, read.lux, 0
+
+
+# State of one series while readSeriesBatch() reads it
+class _SeriesRead:
+
+    def __init__(self, series):
+        self.series = series
+        self.name = "series%d." % series.number
+        self.timed = timing.enabled
+        self.temperature = None
+        self.relative_humidity = None
+        self.lux = None
+        # OSError from a sensor of the series, None if they all read
+        self.error = None
+        # perf_counter() time the HTU31D conversion was started, None if not
+        self.started = None
+        # Seconds spent switching the MUX channel and talking to the HTU31D
+        self.mux = 0
+        self.htu = 0
+
+
+# Backend for the Raspberry Pi, Qwiic MUX, Adafruit sensors and GPIO LEDs
+## addresses = I2C addresses of the MUXes in use, either a list of addresses
+##             on bus 1 or a dict of {bus: addresses}
+# Each bus is opened on its own, bus 1 with board.I2C() and the others with
+## adafruit_extended_bus, so the MUXes and sensors of separate buses are
+## separate devices and can be read in parallel.
+# Sensor drivers are created once per MUX channel and kept between cycles, so
+## the probe/init transactions (ID reads, config writes) only happen once. If a
+## sensor fails, its driver is dropped and it is probed again next cycle.
+## Setting up a driver is timed as "htu_init" or "ltr_init" (see timing.py).
+# The drivers are only used to probe and set up the sensors. Each cycle's
+## reads are single I2C transactions on the driver's device:
+##   HTU31D  one write to start a conversion, and one write/read of the 6
+##           result bytes once it is done (the driver's measurements property
+##           does both with a 20 ms sleep in between, so every series waited
+##           in turn)
+##   LTR390  one write/read of the 3 ALS data bytes. The driver's lux property
+##           also reads the mode, gain and resolution registers every time,
+##           and switches out of UV mode if needed. Nothing here uses UV mode,
+##           so the sensor is left in ALS mode when it is set up, and its lux
+##           factor (from the gain and resolution) is worked out once then.
+class PiBackend(SensorBackend):
+
+    conversion_time = _HTU31D_CONVERSION_TIME
+
+    def __init__(self, addresses=(0x70,)):
+        import qwiic
+        import board
+        import adafruit_htu31d
+        import adafruit_ltr390
+        import RPi.GPIO as GPIO
+
+        self.board = board
+        self.adafruit_htu31d = adafruit_htu31d
+        self.adafruit_ltr390 = adafruit_ltr390
+        self.GPIO = GPIO
+
+        if not isinstance(addresses, dict):
+            addresses = {1: addresses}
+
+        # Instantiates an object for each MUX, by (bus, address)
+        self.muxes = {}
+        for bus in addresses:
+            i2c_driver = None
+            if bus != 1:
+                from qwiic_i2c.linux_i2c import LinuxI2C
+                i2c_driver = LinuxI2C(iBus=bus)
+            for address in addresses[bus]:
+                self.muxes[(bus, address)] = qwiic.QwiicTCA9548A(address=address,
+                    i2c_driver=i2c_driver)
+        # I2C bus objects for the sensor drivers, by bus, created on first use
+        self.i2c = {}
+        # Initialized sensor drivers for each MUX channel, as [ltr, htu], by
+        ## (bus, address, chan)
+        self.sensor_cache = {}
+        # Lux per count of each LTR390's ALS data, by (bus, address, chan)
+        self.lux_factor = {}
+
+    def enableChannel(self, address, chan, bus=1):
+        self.muxes[(bus, address)].enable_channels(chan)
+
+    def disableChannel(self, address, chan, bus=1):
+        self.muxes[(bus, address)].disable_channels(chan)
+
+    def disableAll(self, addresses=None, bus=None):
+        for key in self.muxes:
+            if (bus is None or key[0] == bus) and (addresses is None or key[1] in addresses):
+                self.muxes[key].disable_all()
+
+    # Returns the cached drivers for a MUX channel, as [ltr, htu]
+    def _sensors(self, address, chan, bus=1):
+        if bus not in self.i2c:
+            if bus == 1:
+                self.i2c[bus] = self.board.I2C()
+            else:
+                from adafruit_extended_bus import ExtendedI2C
+                self.i2c[bus] = ExtendedI2C(bus)
+        if (bus, address, chan) not in self.sensor_cache:
+            self.sensor_cache[(bus, address, chan)] = [None, None]
+        return self.sensor_cache[(bus, address, chan)]
+
+    # Returns the HTU31D driver for a MUX channel, probing the sensor if it
+    ## hasn't been set up yet
+    def _htu(self, address, chan, bus=1):
+        sensors = self._sensors(address, chan, bus)
+
+        #Checking if temp/hum sensor is reachable at i2c address
+        if sensors[1] is None:
+            try:
+                if trace.level <= trace.DEBUG:
+                    trace.event(trace.DEBUG, "read", "Probing HTU Sensor",
+                        bus=bus, address=address, channel=chan)
+                start = time.perf_counter()
+                sensors[1] = self.adafruit_htu31d.HTU31D(self.i2c[bus])
+                if timing.enabled:
+                    timing.record("htu_init", time.perf_counter() - start)
+            except (ValueError, OSError) as error:
+                if trace.level <= trace.WARN:
+                    trace.event(trace.WARN, "read", "\tHTU Sensor Down",
+                        bus=bus, address=address, channel=chan, error=str(error))
+                raise OSError(error)
+        return sensors[1]
+
+    def readHTU(self, address, chan, bus=1):
+        self.startHTU(address, chan, bus)
+        time.sleep(self.conversion_time)
+        return self.collectHTU(address, chan, bus)
+
+    def startHTU(self, address, chan, bus=1):
+        htu = self._htu(address, chan, bus)
+        try:
+            with htu.i2c_device as device:
+                device.write(bytes([_HTU31D_CONVERSION]))
+        except OSError:
+            self.sensor_cache[(bus, address, chan)][1] = None
+            raise
+
+    def collectHTU(self, address, chan, bus=1):
+        htu = self._htu(address, chan, bus)
+        data = bytearray(6)
+        try:
+            with htu.i2c_device as device:
+                device.write_then_readinto(bytes([_HTU31D_READTEMPHUM]), data)
+        except OSError:
+            self.sensor_cache[(bus, address, chan)][1] = None
+            raise
+        # Temperature and humidity, each 2 bytes (most significant first) and
+        ## a CRC byte
+        if _crc8(data[0:2]) != data[2] or _crc8(data[3:5]) != data[5]:
+            self.sensor_cache[(bus, address, chan)][1] = None
+            raise OSError("HTU31D on bus %d 0x%02x channel %s returned an invalid CRC" % (bus,
+                address, chan))
+        temperature = -40 + 165 * ((data[0] << 8) | data[1]) / 65535
+        relative_humidity = 100 * ((data[3] << 8) | data[4]) / 65535
+        return temperature, max(min(relative_humidity, 100), 0)
+
+    # Returns the LTR390 driver for a MUX channel, probing the sensor and
+    ## working out its lux factor if it hasn't been set up yet
+    def _ltr(self, address, chan, bus=1):
+        sensors = self._sensors(address, chan, bus)
+
+        #Checking if UV sensor is reachable at i2c address
+        if sensors[0] is None:
+            try:
+                if trace.level <= trace.DEBUG:
+                    trace.event(trace.DEBUG, "read", "\nProbing LTR Sensor",
+                        bus=bus, address=address, channel=chan)
+                start = time.perf_counter()
+                ltr = self.adafruit_ltr390.LTR390(self.i2c[bus])
+                # The driver's first lux read puts the sensor in ALS mode and
+                ## waits for its first measurement
+                ltr.lux
+                self.lux_factor[(bus, address, chan)] = 0.6 * getattr(ltr, "window_factor", 1) / (
+                    _LTR390_GAIN[ltr.gain] * _LTR390_INTEGRATION[ltr.resolution])
+                sensors[0] = ltr
+                if timing.enabled:
+                    timing.record("ltr_init", time.perf_counter() - start)
+            except (ValueError, OSError, RuntimeError) as error:
+                if trace.level <= trace.WARN:
+                    trace.event(trace.WARN, "read", "\tLTR Sensor Down",
+                        bus=bus, address=address, channel=chan, error=str(error))
+                raise OSError(error)
+        return sensors[0]
+
+    # Only lux is read. The UV, raw light and UVI values are more bus
+    ## transactions (and a switch to UV mode) that nothing uses, so they
+    ## aren't read even for tracing.
+    def readLTR(self, address, chan, bus=1):
+        ltr = self._ltr(address, chan, bus)
+        data = bytearray(3)
+        try:
+            with ltr.i2c_device as device:
+                device.write_then_readinto(bytes([_LTR390_ALS_DATA]), data)
+        except OSError:
+            self.sensor_cache[(bus, address, chan)][0] = None
+            raise
+        return (data[0] | (data[1] << 8) | ((data[2] & 0x0F) << 16)) * self.lux_factor[(bus, address, chan)]
+
+    def ledSetup(self, pins):
+        self.GPIO.setmode(self.GPIO.BCM)
+        for x in pins:
+            self.GPIO.setup(x, self.GPIO.OUT)
+            self.GPIO.output(x, self.GPIO.LOW)
+
+    def ledOutput(self, pin, state):
+        self.GPIO.output(pin, state)
+
+    # RPi.GPIO takes lists of pins and values, writing them in a single call
+    def ledWrite(self, pins, states):
+        self.GPIO.output(list(pins), list(states))
+
+    def ledCleanup(self, pins):
+        for x in pins:
+            self.GPIO.output(x, self.GPIO.LOW)
+        self.GPIO.cleanup()
+
+
+# CRC-8 of the HTU31D (polynomial x^8 + x^5 + x^4 + 1, initial value 0)
+## data = bytes the CRC covers
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc = crc ^ byte
+        for x in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+    return crc
+
+
+# Simulated backend, no hardware needed
+# Each channel gets a fixed bias around the base readings, like real sensors
+## that disagree slightly, plus random noise on every read.
+## temperature, humidity, lux = base readings shared by all channels
+## noise = standard deviation of the per-read noise, as a fraction of the base
+## bias = standard deviation of each channel's fixed bias, as a fraction
+## latency = seconds each sensor read takes. For the HTU31D it is the
+##           conversion time, so series read together overlap it.
+## dropout = chance (0-1) that any one sensor read fails
+## seed = random seed, for repeatable runs
+## addresses = accepted for the same call shape as PiBackend, any bus, MUX
+##             address and channel can be read
+class SimBackend(SensorBackend):
+
+    def __init__(self, temperature=21.0, humidity=45.0, lux=150.0, noise=0.005,
+        bias=0.01, latency=0, dropout=0, seed=None, addresses=None):
+        self.base = (temperature, humidity, lux)
+        self.noise = noise
+        self.bias = bias
+        self.latency = latency
+        self.conversion_time = latency
+        self.dropout = dropout
+        self.random = random.Random(seed)
+
+        self.offsets = {}
+        self.enabled = set()
+        # Current state of each LED pin, and counts of pin writes and write
+        ## calls
+        self.leds = {}
+        self.led_writes = 0
+        self.led_calls = 0
+
+    def enableChannel(self, address, chan, bus=1):
+        self.enabled.add((bus, address, chan))
+
+    def disableChannel(self, address, chan, bus=1):
+        self.enabled.discard((bus, address, chan))
+
+    def disableAll(self, addresses=None, bus=None):
+        for key in list(self.enabled):
+            if (bus is None or key[0] == bus) and (addresses is None or key[1] in addresses):
+                self.enabled.discard(key)
+
+    # Returns the fixed bias of a channel's sensors, picking it on first use
+    def _offset(self, address, chan, bus=1):
+        if (bus, address, chan) not in self.offsets:
+            self.offsets[(bus, address, chan)] = [self.random.gauss(1, self.bias) for x in range(3)]
+        return self.offsets[(bus, address, chan)]
+
+    # Simulates the time taken and possible failure of a sensor read
+    ## wait = False for a read that doesn't take the latency
+    def _read(self, address, chan, bus, name, wait=True):
+        if (bus, address, chan) not in self.enabled:
+            raise OSError("%s on bus %d 0x%02x channel %s read while channel disabled" % (name, bus,
+                address, chan))
+        if wait and self.latency > 0:
+            time.sleep(self.latency)
+        if self.dropout > 0 and self.random.random() < self.dropout:
+            raise OSError("%s on bus %d 0x%02x channel %s not responding" % (name, bus, address,
+                chan))
+
+    def readHTU(self, address, chan, bus=1):
+        self._read(address, chan, bus, "HTU31D")
+        return self._htu(address, chan, bus)
+
+    # The conversion time is waited out by readSeriesBatch()
+    def startHTU(self, address, chan, bus=1):
+        self._read(address, chan, bus, "HTU31D", wait=False)
+
+    # A failure is only simulated on starting the conversion, so each cycle
+    ## has the same chance of dropping out as with readHTU()
+    def collectHTU(self, address, chan, bus=1):
+        if (bus, address, chan) not in self.enabled:
+            raise OSError("HTU31D on bus %d 0x%02x channel %s read while channel disabled" % (bus,
+                address, chan))
+        return self._htu(address, chan, bus)
+
+    # Returns a temperature and humidity reading of a channel
+    def _htu(self, address, chan, bus=1):
+        offset = self._offset(address, chan, bus)
+        temperature = self.base[0] * self.random.gauss(offset[0], self.noise)
+        relative_humidity = self.base[1] * self.random.gauss(offset[1], self.noise)
+        return temperature, max(min(relative_humidity, 100), 0)
+
+    def readLTR(self, address, chan, bus=1):
+        self._read(address, chan, bus, "LTR390")
+        offset = self._offset(address, chan, bus)
+        return max(self.base[2] * self.random.gauss(offset[2], self.noise), 0)
+
+    def ledSetup(self, pins):
+        for x in pins:
+            self.leds[x] = LOW
+
+    def ledOutput(self, pin, state):
+        self.leds[pin] = state
+        self.led_writes = self.led_writes + 1
+        self.led_calls = self.led_calls + 1
+
+    def ledWrite(self, pins, states):
+        for x in range(0,len(pins)):
+            self.leds[pins[x]] = states[x]
+        self.led_writes = self.led_writes + len(pins)
+        self.led_calls = self.led_calls + 1
+
+    def ledCleanup(self, pins):
+        for x in pins:
+            self.leds[x] = LOW
+
+
+# Creates the backend with the given name
+## name = "pi" for the Raspberry Pi hardware, "sim" for simulated sensors
+## options = settings passed on to the backend
+def getBackend(name, **options):
+    if name == "pi":
+        return PiBackend(**options)
+    if name == "sim":
+        return SimBackend(**options)
+    raise ValueError("Unknown hardware backend: %s" % name)
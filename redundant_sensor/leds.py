@@ -0,0 +1,77 @@
+# LED State Manager
+#
+# Holds the wanted state of every alert LED as one bit vector, bit x being the
+## x-th pin of the bank. The alert table (see thresholds.py) works out the
+## whole vector each cycle and setState() takes it. apply() then compares the
+## vector against the state last written to the pins, and only the pins that
+## changed are written, in one batch through the backend.
+## On a steady cycle nothing is written at all.
+# The same bit vector is what gets logged, so the log always shows exactly
+## what the LEDs were set to.
+
+from .hardware import HIGH, LOW
+from . import trace
+
+
+# A bank of LED pins driven from a bit vector
+## backend = hardware backend the pins are written through
+## pins = list of LED GPIO pins, in bit (and log) order
+class LedBank:
+
+    def __init__(self, backend, pins):
+        self.backend = backend
+        self.pins = list(pins)
+        self.bit = {}
+        for x in range(0,len(self.pins)):
+            self.bit[self.pins[x]] = x
+        # Wanted state, and the state last written to the pins
+        self.state = 0
+        self.applied = 0
+
+    # Sets up the pins as outputs, all off
+    def setup(self):
+        self.backend.ledSetup(self.pins)
+        self.state = 0
+        self.applied = 0
+
+    # Sets the wanted state of every LED at once
+    ## state = bit vector, bit x for the x-th pin of the bank
+    def setState(self, state):
+        self.state = state
+
+    # Position of 'pin' in the bank, starting at 1 as in the log headers
+    def number(self, pin):
+        return self.bit[pin] + 1
+
+    # Writes the pins whose wanted state differs from the last written state
+    # Returns the number of pins written
+    def apply(self):
+        changed = self.state ^ self.applied
+        if changed == 0:
+            return 0
+        pins = []
+        states = []
+        for x in range(0,len(self.pins)):
+            if changed >> x & 1:
+                pins.append(self.pins[x])
+                states.append(HIGH if self.state >> x & 1 else LOW)
+        self.backend.ledWrite(pins, states)
+        self.applied = self.state
+        if trace.level <= trace.INFO:
+            changed = ["L%02d" % self.number(p) for p in pins]
+            trace.event(trace.INFO, "leds", "LEDs changed: %s" % ", ".join(changed),
+                leds=changed, state=self.state)
+        return len(pins)
+
+    # Returns the state of each LED as a list of 0/1, in bank order
+    ## state = bit vector to expand, defaults to the wanted state
+    def bits(self, state=None):
+        if state is None:
+            state = self.state
+        return [state >> x & 1 for x in range(0,len(self.pins))]
+
+    # Turns all LEDs off and releases the pins
+    def cleanup(self):
+        self.backend.ledCleanup(self.pins)
+        self.state = 0
+        self.applied = 0
@@ -0,0 +1,134 @@
+# Buffered CSV Log Writer
+#
+# Keeps the current day's log file open between cycles and buffers rows in
+## memory, writing them out once enough rows are waiting or enough time has
+## passed since the last flush. This avoids an open/close and a metadata write
+## on the SD card for every sample.
+# A new log file is started exactly at midnight. Rows are placed in the file
+## for the date they were recorded on, not the date they happen to be flushed.
+# Buffered rows are flushed when the writer is closed, and on interpreter exit
+## as a fallback, so nothing is lost on Ctrl + C.
+
+import atexit
+import csv
+import os
+import time
+from datetime import datetime, timedelta
+
+from . import trace
+
+# Returns the column headers written at the top of each new log file
+## series_count = number of sensor series, one status column each
+## led_count = number of LEDs, one state column each
+def logHeaders(series_count, led_count):
+    headers = ['Date', 'Time Stamp', 'Temperature', 'Relative Humidity',
+    'Current Lux', 'Cumulative Lux Hours']
+    headers = headers + ['Series %d' % (x + 1) for x in range(series_count)]
+    headers = headers + ['L%02d' % (x + 1) for x in range(led_count)]
+    return headers
+
+# Column headers for the original layout of 3 series and 17 LEDs
+LOG_HEADERS = logHeaders(3, 17)
+
+# Returns the column headers at the top of an existing log file, None if it
+## has none
+## path = path to the log file
+def readHeaders(path):
+    with open(path, newline='') as f:
+        return next(csv.reader(f), None)
+
+
+# Writes data rows to a daily CSV log file. If the file doesn't exist a new one
+## is created with column headers, otherwise rows are appended to it.
+# If the day's file has different headers (the series or LEDs were changed
+## since it was started), a numbered file (sensor_log_<date>_1.csv, ...) is
+## used instead, so every file has one column layout.
+## prefix = start of the log file name, followed by the date
+## flush_rows = number of buffered rows that triggers a write to disk
+## flush_interval = max seconds a row may wait in the buffer
+## headers = column headers for new log files
+## directory = folder the log files are kept in
+class LogWriter:
+
+    def __init__(self, prefix="sensor_log_", flush_rows=10, flush_interval=60,
+        headers=LOG_HEADERS, directory="."):
+        self.prefix = prefix
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.headers = headers
+        self.directory = directory
+
+        self.path = None
+        self.csvfile = None
+        self.csvwriter = None
+        self.rotate_at = None
+        self.rows = []
+        self.last_flush = time.monotonic()
+
+        atexit.register(self.close)
+
+    # Opens (or creates) the log file for the day of 'now' and works out when
+    ## the next rotation is due
+    def _open(self, now):
+        currentDate = now.strftime("%b-%d-%Y")
+        name = self.prefix + currentDate
+        self.path = os.path.join(self.directory, name + ".csv")
+        n = 1
+        while (os.path.exists(self.path) and os.path.getsize(self.path) > 0 and
+            readHeaders(self.path) != list(self.headers)):
+            self.path = os.path.join(self.directory, "%s_%d.csv" % (name, n))
+            n = n + 1
+
+        # Checking if Log file exists
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.csvfile = open(self.path, 'a', newline='')
+        self.csvwriter = csv.writer(self.csvfile)
+        if new_file:
+            if trace.level <= trace.INFO:
+                trace.event(trace.INFO, "log", "Creating "+self.path, path=self.path)
+            self.csvwriter.writerow(self.headers)
+
+        self.rotate_at = datetime.combine(now.date() + timedelta(days=1),
+            datetime.min.time())
+
+    # Writes any buffered rows to the open file and flushes it to disk
+    def flush(self):
+        if self.csvfile is None:
+            return
+        if self.rows:
+            self.csvwriter.writerows(self.rows)
+            self.rows = []
+        self.csvfile.flush()
+        self.last_flush = time.monotonic()
+
+    # Queues a row for the log file of the day it was recorded on
+    ## dataList = data to append to next line of CSV log file
+    ## now = datetime the row was recorded at, defaults to the current time
+    def write(self, dataList, now=None):
+        if now is None:
+            now = datetime.now()
+
+        # Rotating to a new file at midnight
+        if self.csvfile is None or now >= self.rotate_at:
+            self.close()
+            self._open(now)
+
+        self.rows.append(dataList)
+        if (len(self.rows) >= self.flush_rows or
+            time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    # Flushes any buffered rows and closes the current log file
+    def close(self):
+        if self.csvfile is None:
+            return
+        self.flush()
+        self.csvfile.close()
+        self.csvfile = None
+        self.csvwriter = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
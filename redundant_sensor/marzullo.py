@@ -0,0 +1,232 @@
+# Marzullo's Algorithm
+#
+# Sweep-line implementation of Marzullo's Algorithm. Each interval contributes
+# a start and an end point, the 2N points are sorted once and walked in a single
+# pass while keeping a running count of how many intervals are currently open.
+# The region where that count peaks is the smallest interval consistent with the
+# largest number of sources.
+#
+# Sorting dominates, so a call costs O(N log N) instead of the O(N^2) of the
+# nested loop used by earlier versions of sensor_fusion.py.
+#
+# marzulloBatch applies the same sweep to a whole array of interval sets at once
+## using NumPy, for re-processing logged data or fusing many sites together.
+#
+# MarzulloTracker fuses one quantity cycle after cycle. It keeps the sorted
+## endpoints from the previous cycle and only moves the endpoints of the
+## intervals that changed, so a cycle where few readings moved costs far less
+## than sorting again.
+
+from bisect import bisect_left
+from itertools import accumulate, compress, count
+from operator import ne
+
+import numpy as np
+
+from . import trace
+
+# Endpoint tags. Starts sort before ends at the same value, so intervals that
+## only touch (e.g. [1, 2] and [2, 3]) are still counted as intersecting.
+_START = 0
+_END = 1
+
+# Change in the number of open intervals at each type of endpoint
+_DELTA = (1, -1)
+
+# Name and unit of each type of data, for the trace
+_QUANTITY = [("Temperature", " C"), ("Humidity", "%"), ("Lux", "")]
+
+
+# Records the new range of one type of data as a trace event
+## t = the type of data (0 = temp, 1 = humidity, 2 = lux)
+def _traceRange(t, low, high, support):
+    name, unit = _QUANTITY[t]
+    trace.event(trace.DEBUG, "fuse", "\nNew %s Range: [%0.1f%s , %0.1f%s ]" %
+        (name, low, unit, high, unit), quantity=name.lower(), low=low, high=high,
+        support=support)
+
+
+# Runs Marzullo's Algorithm on a set of data pairs
+# Returns the smallest interval consistent with largest number of sources, and
+## the number of sources (support) that agree on it.
+## intervals = The set of data pairs passed to the function
+## N = The number of pairs sent (The length)
+## t = The type of data, used for formatting the output
+def marzulloSweep(intervals, N, t):
+
+    if N == 0:
+        return 0, 0, 0
+
+    # Tagging and sorting the 2N endpoints
+    endpoints = []
+    for x in range(0,N):
+        endpoints.append((intervals[x][0], _START))
+        endpoints.append((intervals[x][1], _END))
+    endpoints.sort()
+
+    m_left = intervals[0][0]
+    m_right = intervals[0][1]
+    m_support = 0 # Highest number of overlapping intervals seen
+    c_support = 0 # Current number of overlapping intervals
+
+    for i in range(0,2*N):
+        if endpoints[i][1] == _START:
+            c_support = c_support + 1
+            # The point after a new maximum is always an end, which closes
+            ## the best region
+            if c_support > m_support:
+                m_support = c_support
+                m_left = endpoints[i][0]
+                m_right = endpoints[i+1][0]
+        else:
+            c_support = c_support - 1
+
+    if trace.level <= trace.DEBUG:
+        _traceRange(t, m_left, m_right, m_support)
+
+    return m_left, m_right, m_support
+
+
+# Runs Marzullo's Algorithm on many sets of data pairs in one vectorized call
+# Each row along the second to last axis is one source, so an array shaped
+## (cycles, sensors, 2) fuses every cycle at once. Extra leading axes are kept,
+## e.g. (quantities, cycles, sensors, 2) fuses several quantities together.
+# Missing readings (a series that was down) are marked by NaN in either bound
+## and are left out of that set. A set with no valid sources returns NaN
+## low/high values and a support of 0.
+# Returns low, high and support arrays shaped like the input minus its last
+## two axes.
+## intervals = array-like of data pairs, shape (..., sensors, 2)
+def marzulloBatch(intervals):
+
+    intervals = np.asarray(intervals, dtype=np.float64)
+    shape = intervals.shape[:-2]
+    S = intervals.shape[-2]
+    intervals = intervals.reshape(-1, S, 2)
+    C = intervals.shape[0]
+
+    if S == 0:
+        return (np.full(shape, np.nan), np.full(shape, np.nan),
+            np.zeros(shape, dtype=np.int64))
+
+    # Flattening each set into its 2S endpoints, start/end interleaved
+    valid = ~np.isnan(intervals).any(axis=2)
+    valid = np.repeat(valid, 2, axis=1)
+    values = np.where(valid, intervals.reshape(C, 2*S), np.inf)
+    tags = np.broadcast_to(np.tile([_START, _END], S), (C, 2*S))
+    deltas = np.where(valid, np.where(tags == _START, 1, -1), 0)
+
+    # Sorting by value, starts before ends on ties, invalid points sort last
+    order = np.lexsort((tags, values), axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    counts = np.cumsum(np.take_along_axis(deltas, order, axis=1), axis=1)
+
+    # First point where the running count peaks opens the best region, the
+    ## next point closes it
+    best = np.argmax(counts, axis=1)[:, None]
+    support = np.take_along_axis(counts, best, axis=1)[:, 0]
+    low = np.take_along_axis(values, best, axis=1)[:, 0]
+    high = np.take_along_axis(values, np.minimum(best + 1, 2*S - 1), axis=1)[:, 0]
+
+    low = np.where(support > 0, low, np.nan)
+    high = np.where(support > 0, high, np.nan)
+
+    return low.reshape(shape), high.reshape(shape), support.reshape(shape)
+
+
+# Marzullo's Algorithm for one quantity that is fused every cycle
+# Readings are rounded to 0.01, so at high loop rates most series read the same
+## as last cycle. The tracker keeps last cycle's endpoints sorted, as
+## (value, tag, interval number), with the +1/-1 change in open intervals at
+## each one. Each cycle it:
+##  - finds the intervals that changed since last cycle
+##  - if only a few changed (patch_max or less, as a fraction of all of them),
+##    takes their two endpoints out and puts the new ones back in at their
+##    sorted places (binary search), and finds the peak of the running count
+##  - otherwise runs marzulloSweep, which is quicker than patching most of the
+##    list, and sorts again once the readings settle
+##  - starts over when the number of intervals changes (a series went down or
+##    came back)
+# Returns the same results as marzulloSweep for the same intervals.
+## t = The type of data, used for formatting the output
+## patch_max = largest fraction of intervals that are patched rather than
+##             sorted again
+class MarzulloTracker:
+
+    def __init__(self, t, patch_max=0.1):
+        self.t = t
+        self.patch_max = patch_max
+        self.previous = None
+        self.points = None
+        self.deltas = None
+        # How each cycle was fused, for tuning and benchmarks
+        self.patched = 0
+        self.sorted = 0
+        self.swept = 0
+
+    # Runs Marzullo's Algorithm on this cycle's data pairs
+    # Returns low, high and support, as marzulloSweep does
+    ## intervals = The set of data pairs for this cycle
+    def fuse(self, intervals):
+        N = len(intervals)
+        if N == 0:
+            self.reset()
+            return 0, 0, 0
+
+        previous = self.previous
+        self.previous = list(intervals)
+        if previous is None or len(previous) != N:
+            changed = None
+        else:
+            changed = list(compress(count(), map(ne, intervals, previous)))
+
+        if changed is None or len(changed) > self.patch_max * N:
+            self.points = None
+            self.swept = self.swept + 1
+            return marzulloSweep(intervals, N, self.t)
+
+        if self.points is None:
+            self._sort(intervals)
+            self.sorted = self.sorted + 1
+        else:
+            points = self.points
+            deltas = self.deltas
+            for x in changed:
+                for tag in (_START, _END):
+                    i = bisect_left(points, (previous[x][tag], tag, x))
+                    del points[i]
+                    del deltas[i]
+                    point = (intervals[x][tag], tag, x)
+                    i = bisect_left(points, point)
+                    points.insert(i, point)
+                    deltas.insert(i, _DELTA[tag])
+            self.patched = self.patched + 1
+
+        # The first peak in the running count opens the best region, the next
+        ## point closes it
+        counts = list(accumulate(self.deltas))
+        m_support = max(counts)
+        best = counts.index(m_support)
+        m_left = self.points[best][0]
+        m_right = self.points[best + 1][0]
+
+        if trace.level <= trace.DEBUG:
+            _traceRange(self.t, m_left, m_right, m_support)
+
+        return m_left, m_right, m_support
+
+    # Sorts the endpoints of a set of data pairs from scratch
+    def _sort(self, intervals):
+        points = []
+        for x in range(0,len(intervals)):
+            points.append((intervals[x][0], _START, x))
+            points.append((intervals[x][1], _END, x))
+        points.sort()
+        self.points = points
+        self.deltas = [_DELTA[point[1]] for point in points]
+
+    # Forgets the saved endpoints, the next cycle starts over
+    def reset(self):
+        self.previous = None
+        self.points = None
+        self.deltas = None
@@ -0,0 +1,177 @@
+# Live Metrics Endpoint
+#
+# Serves the latest fused values, precision, series status, LED states and loop
+## timings over HTTP, from a background thread:
+#
+#   /metrics   Prometheus text format
+#   /json      the same values as JSON
+#   /trace     the recent trace events kept in memory (see trace.py)
+#
+# The sampling loop only hands over a new snapshot each cycle (one reference
+## assignment), and all formatting happens on the server's threads when a
+## request comes in, so a slow or busy client never holds up the loop.
+#
+# Snapshot layout, as built by sensor_fusion.py:
+#   {"time": epoch seconds,
+#    "temperature": {"low", "high", "median", "precision"}, "humidity": {...},
+#    "lux": {...}, "lux_hours": .., "humidity_changed": 0/1,
+#    "series": [{"series", "address", "channel", "down", "down_cycles"}, ...],
+#    "leds": [{"led", "pin", "on"}, ...],
+#    "loop": {"period", "cycle_seconds", "late_seconds", "cycles",
+#             "overruns", "missed"},
+#    "timing": None, or the last stage timing summary (see timing.py)}
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import trace
+
+# Snapshot key, Prometheus names (value, precision) and help text of each
+## fused quantity. Lux precision is a percentage of the median, temperature
+## and humidity precision are in their own units.
+_QUANTITIES = [
+    ("temperature", "sensor_temperature_celsius",
+        "sensor_temperature_precision_celsius", "temperature (C)"),
+    ("humidity", "sensor_humidity_percent",
+        "sensor_humidity_precision_percent", "relative humidity (%)"),
+    ("lux", "sensor_lux", "sensor_lux_precision_percent", "light level (lux)")]
+
+
+# Formats a snapshot in the Prometheus text format
+def prometheusText(snapshot):
+    lines = []
+
+    def metric(name, kind, text, samples):
+        lines.append("# HELP %s %s" % (name, text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            if labels:
+                label = ",".join('%s="%s"' % (k, v) for k, v in labels)
+                lines.append("%s{%s} %s" % (name, label, _number(value)))
+            else:
+                lines.append("%s %s" % (name, _number(value)))
+
+    if snapshot is None:
+        metric("sensor_up", "gauge", "1 once the first cycle has completed", [((), 0)])
+        return "\n".join(lines) + "\n"
+
+    metric("sensor_up", "gauge", "1 once the first cycle has completed", [((), 1)])
+    metric("sensor_last_cycle_timestamp_seconds", "gauge",
+        "Time of the last completed cycle", [((), snapshot["time"])])
+    for key, name, precision, text in _QUANTITIES:
+        values = snapshot[key]
+        metric(name, "gauge", "Fused " + text, [((("bound", b),), values[b])
+            for b in ("low", "median", "high")])
+        metric(precision, "gauge", "Precision (+/-) of the fused " + text,
+            [((), values["precision"])])
+    metric("sensor_lux_hours", "gauge", "Cumulative lux hours over the last 24 hours",
+        [((), snapshot["lux_hours"])])
+    metric("sensor_humidity_changed", "gauge",
+        "1 if humidity changed more than the hourly limit", [((), snapshot["humidity_changed"])])
+    metric("sensor_series_down", "gauge", "1 if the series was down this cycle",
+        [((("series", s["series"]), ("address", s["address"]), ("channel", s["channel"])),
+            s["down"]) for s in snapshot["series"]])
+    metric("sensor_series_down_cycles", "gauge", "Cycles the series has been down in a row",
+        [((("series", s["series"]),), s["down_cycles"]) for s in snapshot["series"]])
+    metric("sensor_led_on", "gauge", "1 if the alert LED is on",
+        [((("led", l["led"]), ("pin", l["pin"])), l["on"]) for l in snapshot["leds"]])
+
+    loop = snapshot["loop"]
+    metric("sensor_loop_period_seconds", "gauge", "Configured loop period", [((), loop["period"])])
+    metric("sensor_loop_cycle_seconds", "gauge", "Processing time of the last cycle",
+        [((), loop["cycle_seconds"])])
+    metric("sensor_loop_late_seconds", "gauge", "How late the last cycle finished, 0 if on time",
+        [((), loop["late_seconds"])])
+    metric("sensor_loop_cycles_total", "counter", "Cycles completed", [((), loop["cycles"])])
+    metric("sensor_loop_overruns_total", "counter", "Cycles that overran their period",
+        [((), loop["overruns"])])
+    metric("sensor_loop_missed_total", "counter", "Cycle slots skipped after overruns",
+        [((), loop["missed"])])
+
+    timing = snapshot.get("timing")
+    if timing is not None:
+        stages = timing["stages"]
+        samples = []
+        for name in stages:
+            for q in ("p50", "p95", "p99"):
+                samples.append(((("stage", name), ("quantile", "0." + q[1:])), stages[name][q]))
+        metric("sensor_stage_seconds", "summary",
+            "Time each stage took over the last timing interval", samples)
+        for name in stages:
+            lines.append('sensor_stage_seconds_sum{stage="%s"} %s' %
+                (name, _number(stages[name]["mean"] * stages[name]["count"])))
+            lines.append('sensor_stage_seconds_count{stage="%s"} %s' %
+                (name, _number(stages[name]["count"])))
+        metric("sensor_stage_max_seconds", "gauge",
+            "Longest time each stage took over the last timing interval",
+            [((("stage", name),), stages[name]["max"]) for name in stages])
+        metric("sensor_timing_overhead_ratio", "gauge",
+            "Share of the cycle time spent timing the stages", [((), timing["overhead"])])
+    return "\n".join(lines) + "\n"
+
+
+# Formats a number for the Prometheus text format
+def _number(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value))
+
+
+# Request handler, answers /metrics and /json from the server's snapshot,
+## and /trace from the trace ring
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        snapshot = self.server.snapshot
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = prometheusText(snapshot).encode()
+            kind = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/json":
+            body = json.dumps(snapshot).encode()
+            kind = "application/json"
+        elif path == "/trace":
+            body = json.dumps(trace.recent(), default=str).encode()
+            kind = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Requests are traced at debug level instead of printed
+    def log_message(self, format, *args):
+        if trace.level <= trace.DEBUG:
+            trace.event(trace.DEBUG, "metrics", format % args,
+                client=self.address_string())
+
+
+# HTTP server for the live metrics, run on a daemon thread
+## port = TCP port to listen on
+## host = address to listen on
+class MetricsServer:
+
+    def __init__(self, port, host="0.0.0.0"):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.snapshot = None
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+            name="metrics-http", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    # Makes a new snapshot the one that is served
+    ## The snapshot must not be changed afterwards, build a new one each cycle
+    def publish(self, snapshot):
+        self.httpd.snapshot = snapshot
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,281 @@
+# Raw Sensor Capture
+#
+# Records every series' own readings each cycle, before they are fused, so the
+## fusion can be run again later (see refuse() and replay.py) or a drifting
+## sensor can be tracked down without collecting the data again.
+#
+# Each cycle is one fixed-width record:
+#
+#   time         float64          seconds since the epoch
+#   readings     float32[S, 3]    temperature, humidity, lux of each series,
+#                                 NaN where a series is down or has no sensor
+#                                 for that quantity
+#   down         uint8[]          bitmask of series down, bit x for series x + 1
+#
+# A header at the start of each file gives the number of series and the
+## precision of each one's sensors, so a file can be re-fused on its own. With
+## 3 series a record is 45 bytes.
+# Files rotate at midnight (raw_log_<date>.raw), and also once a file reaches
+## 1/8 of max_bytes, when the day carries on in a numbered file
+## (raw_log_<date>_1.raw, ...). Disk use is bounded: once the raw files in the
+## folder add up to more than max_bytes, the oldest are deleted. The file
+## currently being written is never deleted, but as it is at most 1/8 of the
+## limit, there are always older files that can be.
+
+import atexit
+import glob
+import os
+import struct
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .marzullo import marzulloBatch
+from . import trace
+
+# File header: magic string, series count, then 3 float32 precisions per series
+_MAGIC = b"RSPRAW1\n"
+_HEADER = struct.Struct("<8sH6x")
+
+# Number of files max_bytes is shared out between, a file is closed and the
+## next one started once it reaches max_bytes / _PARTS
+_PARTS = 8
+
+
+# Returns the record dtype for a number of series
+def recordType(series_count):
+    return np.dtype([("time", "<f8"), ("readings", "<f4", (series_count, 3)),
+        ("down", "u1", (-(-series_count // 8),))])
+
+
+# Returns the size in bytes of the header for a number of series
+def headerSize(series_count):
+    return _HEADER.size + series_count * 3 * 4
+
+
+# Reads the header of a raw capture file
+# Returns the precision array (series x [temperature, humidity, lux])
+# Raises ValueError if the file isn't a raw capture
+def readHeader(path):
+    with open(path, "rb") as f:
+        data = f.read(_HEADER.size)
+        if len(data) < _HEADER.size:
+            raise ValueError("%s: too short to be a raw capture" % path)
+        magic, series_count = _HEADER.unpack(data)
+        if magic != _MAGIC:
+            raise ValueError("%s: not a raw capture" % path)
+        data = f.read(series_count * 3 * 4)
+    if len(data) < series_count * 3 * 4:
+        raise ValueError("%s: too short to be a raw capture" % path)
+    return np.frombuffer(data, dtype="<f4").reshape(series_count, 3).astype(float)
+
+
+# Memory-maps a raw capture file as a NumPy structured array
+# A partly written record at the end of the file is left out
+# Returns records, precision (series x [temperature, humidity, lux])
+## path = path to the raw capture file
+def readRaw(path):
+    precision = readHeader(path)
+    series_count = len(precision)
+    dtype = recordType(series_count)
+    offset = headerSize(series_count)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype), precision
+    records = np.memmap(path, dtype=dtype, mode="r", offset=offset,
+        shape=(count,))
+    return records, precision
+
+
+# Fuses raw readings again with Marzullo's Algorithm, all cycles at once
+# Series that are down, or missing a sensor, are left out as in the live loop.
+## Where no series is up the fused range is 0, as sensor_fusion.py reports it.
+# Returns low, high (cycles x [temperature, humidity, lux]) and support
+## records, precision = from readRaw()
+def refuse(records, precision):
+    readings = np.asarray(records["readings"], dtype=float)
+    # Temperature and humidity precision are in their own units, lux
+    ## precision is a fraction of the reading
+    spread = np.empty_like(readings)
+    spread[:, :, 0:2] = precision[None, :, 0:2]
+    spread[:, :, 2] = np.abs(readings[:, :, 2]) * precision[None, :, 2]
+
+    # Intervals as (cycles, quantity, series, 2)
+    intervals = np.stack([readings - spread, readings + spread], axis=-1)
+    intervals = intervals.transpose(0, 2, 1, 3)
+    low, high, support = marzulloBatch(intervals)
+    low = np.where(support > 0, low, 0)
+    high = np.where(support > 0, high, 0)
+    return low, high, support
+
+
+# Writes every series' readings to daily raw capture files
+## series_list = the SensorSeries being read (see config.py)
+## prefix = start of the file name, followed by the date
+## max_bytes = most disk space the raw files in the folder may take up
+## flush_rows = number of buffered records that triggers a write to disk
+## flush_interval = max seconds a record may wait in the buffer
+## directory = folder the files are kept in
+class RawLogWriter:
+
+    def __init__(self, series_list, prefix="raw_log_", max_bytes=64*1024*1024,
+        flush_rows=10, flush_interval=60, directory="."):
+        self.series_count = len(series_list)
+        self.precision = np.array([[s.temp_precision, s.hum_precision,
+            s.lux_precision] for s in series_list], dtype="<f4")
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.part_bytes = max(max_bytes // _PARTS, 1)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.directory = directory
+
+        self.dtype = recordType(self.series_count)
+        self.down_bytes = self.dtype["down"].shape[0]
+        self.record = struct.Struct("<d%df%ds" % (self.series_count * 3, self.down_bytes))
+
+        self.path = None
+        self.file = None
+        self.rotate_at = None
+        self.rows = []
+        # Bytes in the current file, and in all the raw files in the folder
+        self.file_bytes = 0
+        self.disk_bytes = 0
+        # True once prune() has deleted everything it can, until a new file
+        ## is started
+        self.pruned = False
+        self.last_flush = time.monotonic()
+
+        atexit.register(self.close)
+
+    # Returns True if the file at 'path' was written for the same series
+    def _matches(self, path):
+        try:
+            precision = readHeader(path)
+        except ValueError:
+            return False
+        return precision.shape == self.precision.shape and np.allclose(precision, self.precision)
+
+    # Returns the path of part n of a day's files, the first has no number
+    def _partPath(self, name, n):
+        if n == 0:
+            return os.path.join(self.directory, name + ".raw")
+        return os.path.join(self.directory, "%s_%d.raw" % (name, n))
+
+    # Opens (or creates) the file for the day of 'now' and works out when the
+    ## next rotation is due
+    # If the day's file was written for a different set of series, or is
+    ## already full (part_bytes), a numbered file is used instead
+    def _open(self, now):
+        currentDate = now.strftime("%b-%d-%Y")
+        name = self.prefix + currentDate
+        # Carrying on in the day's last file, the oldest ones may have been
+        ## deleted already
+        n = 0
+        for path in glob.glob(os.path.join(glob.escape(self.directory), glob.escape(name) + "_*.raw")):
+            part = os.path.splitext(os.path.basename(path))[0][len(name) + 1:]
+            if part.isdigit():
+                n = max(n, int(part))
+        self.path = self._partPath(name, n)
+        while (os.path.exists(self.path) and os.path.getsize(self.path) > 0 and
+            (os.path.getsize(self.path) >= self.part_bytes or not self._matches(self.path))):
+            n = n + 1
+            self.path = self._partPath(name, n)
+
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, "ab")
+        if new_file:
+            if trace.level <= trace.INFO:
+                trace.event(trace.INFO, "log", "Creating "+self.path, path=self.path)
+            self.file.write(_HEADER.pack(_MAGIC, self.series_count))
+            self.file.write(self.precision.tobytes())
+            self.file.flush()
+        else:
+            # Dropping a partly written record left by a crash
+            size = os.path.getsize(self.path)
+            extra = (size - headerSize(self.series_count)) % self.dtype.itemsize
+            if extra != 0:
+                self.file.truncate(size - extra)
+        self.file_bytes = os.path.getsize(self.path)
+
+        self.rotate_at = datetime.combine(now.date() + timedelta(days=1),
+            datetime.min.time())
+        self.pruned = False
+        self.prune()
+
+    # Deletes the oldest raw files until the folder is back under max_bytes
+    # If that isn't enough (only the current file is left), nothing more is
+    ## tried until the next file is started
+    def prune(self):
+        paths = glob.glob(os.path.join(glob.escape(self.directory), self.prefix + "*.raw"))
+        paths.sort(key=os.path.getmtime)
+        sizes = [os.path.getsize(p) for p in paths]
+        self.disk_bytes = sum(sizes)
+        for x in range(0,len(paths)):
+            if self.disk_bytes <= self.max_bytes:
+                break
+            if self.path is not None and os.path.abspath(paths[x]) == os.path.abspath(self.path):
+                continue
+            os.remove(paths[x])
+            self.disk_bytes = self.disk_bytes - sizes[x]
+            if trace.level <= trace.INFO:
+                trace.event(trace.INFO, "log", "Deleted "+paths[x], path=paths[x])
+        self.pruned = self.disk_bytes > self.max_bytes
+
+    # Writes any buffered records to the open file and flushes it to disk
+    def flush(self):
+        if self.file is None:
+            return
+        if self.rows:
+            data = b"".join(self.rows)
+            self.file.write(data)
+            self.rows = []
+            self.file_bytes = self.file_bytes + len(data)
+            self.disk_bytes = self.disk_bytes + len(data)
+        self.file.flush()
+        self.last_flush = time.monotonic()
+        if self.disk_bytes > self.max_bytes and not self.pruned:
+            self.prune()
+
+    # Queues one cycle's readings for the file of the day they were taken on
+    ## now = datetime of the cycle
+    ## readings = list of (temperature, relative_humidity, lux, up_down), one
+    ##            per series, as returned by the acquirer
+    def write(self, now, readings):
+        # Rotating to a new file at midnight, or once the current one is full
+        if self.file is None or now >= self.rotate_at or self.file_bytes >= self.part_bytes:
+            self.close()
+            self._open(now)
+
+        values = []
+        down = 0
+        for x in range(0,len(readings)):
+            temperature, relative_humidity, lux, up_down = readings[x]
+            if up_down == 1:
+                down = down | (1 << x)
+                values.extend((np.nan, np.nan, np.nan))
+                continue
+            values.append(np.nan if temperature is None else temperature)
+            values.append(np.nan if relative_humidity is None else relative_humidity)
+            values.append(np.nan if lux is None else lux)
+        self.rows.append(self.record.pack(now.timestamp(), *values,
+            down.to_bytes(self.down_bytes, "little")))
+
+        if (len(self.rows) >= self.flush_rows or
+            time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    # Flushes any buffered records and closes the current file
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,315 @@
+# Offline Log Replay
+#
+# Runs archived logs back through the same Lux Hours, humidity change and
+## alert threshold stages as the live loop, as fast as the CPU allows, and
+## reports the alerts that would have fired. Thresholds (or any other setting
+## in sensor_fusion.py) can be changed for the replay with --set, so a new
+## threshold can be tried against months of data before it is deployed.
+#
+# The CSV logs (sensor_log_<date>.csv), binary logs (.bin, see binlog.py) and
+## raw captures (raw_log_<date>.raw, see rawlog.py) can be replayed. Each day
+## file is replayed in its own process,
+## spread over all CPU cores. The rolling windows and alert states are warmed
+## up with the end of the previous day's file, if it was given too, so each day
+## starts where the live loop would have been.
+#
+# Raw captures hold every series' own readings, so Marzullo's Algorithm is run
+## again on them and the alerts see the full fused range, as in the live loop.
+## The CSV and binary logs only hold the fused median of each quantity, so the
+## median is used as both the low and high end of the range. Either way, Lux
+## Hours are worked out again from the fused lux.
+#
+# Usage:
+##  python3 -m redundant_sensor.replay sensor_log_*.csv
+##  python3 -m redundant_sensor.replay --set temp_hs=22 --set alert_dwell=60 sensor_log_*.csv
+##  python3 -m redundant_sensor.replay --json --workers 4 logs/*.bin
+##  python3 -m redundant_sensor.replay --set alert_dwell=0 raw_log_*.raw
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from . import sensor_fusion
+from . import binlog
+from . import rawlog
+from . import trace
+from .config import SensorSeries
+from .thresholds import ThresholdTable
+from .windows import RollingMinMax, LuxHoursIntegrator
+
+
+# Loads a CSV log, binary log or raw capture file
+# Returns times (epoch seconds), ranges (rows x [lowT, highT, lowH, highH, lowL,
+## highL]) and down (rows x series, 1 where the series was down)
+## path = path to the log file
+def loadLog(path):
+    if path.endswith(".raw"):
+        records, precision = rawlog.readRaw(path)
+        low, high, support = rawlog.refuse(records, precision)
+        ranges = np.stack([low, high], axis=2).reshape(-1, 6)
+        down = binlog.unpackMasks(records["down"], len(precision))
+        return np.array(records["time"], dtype=float), ranges, down
+
+    if path.endswith(".bin"):
+        records, series_count, led_count = binlog.readLog(path)
+        values = np.stack([records["temperature"], records["humidity"],
+            records["lux"]], axis=1).astype(float)
+        down = binlog.unpackMasks(records["series"], series_count)
+        return np.array(records["time"], dtype=float), np.repeat(values, 2, axis=1), down
+
+    times = []
+    values = []
+    down = []
+    # Columns holding the status of each series, found from the headers
+    series = None
+    with open(path, newline="") as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) < 6:
+                continue
+            if row[0] == "Date":
+                series = [x for x in range(6, len(row)) if row[x].startswith("Series")]
+                continue
+            if series is None:
+                series = [x for x in range(6, len(row)) if row[x] in ("Up", "Down")]
+            dateTimeObj = datetime.strptime(row[0] + " " + row[1],
+                "%b-%d-%Y %H:%M:%S.%f")
+            times.append(dateTimeObj.timestamp())
+            values.append([float(row[2]), float(row[3]), float(row[4])])
+            down.append([1 if row[x] == "Down" else 0 for x in series])
+    # A log with no rows yet (only its header, or nothing at all) still gives
+    ## arrays of the right width, with the series count from the header
+    values = np.array(values, dtype=float).reshape(-1, 3)
+    series_count = len(series) if series is not None else 0
+    return (np.array(times, dtype=float), np.repeat(values, 2, axis=1),
+        np.array(down, dtype=np.uint8).reshape(len(times), series_count))
+
+
+# Sets sensor_fusion settings for the replay
+## overrides = dict of setting name to new value
+def applyOverrides(overrides):
+    for name in overrides:
+        setattr(sensor_fusion, name, overrides[name])
+
+
+# Returns the sensor series to replay a log with series_count series
+## The configured series are used, with their LEDs, as far as they go
+def replaySeries(series_count):
+    if not sensor_fusion.series_list:
+        sensor_fusion.loadConfig()
+    configured = sensor_fusion.series_list
+    series_list = []
+    for x in range(series_count):
+        if x < len(configured):
+            series_list.append(configured[x])
+        else:
+            series_list.append(SensorSeries(x + 1, 0x70 + x // 8, x % 8))
+    return series_list
+
+
+# Replays the loop stages over one log, adding the rows replayed and, for each
+## alert, the number of times it turned on and the seconds it was on to 'state'
+## state = replay state from newState()
+## times, ranges, down = log contents from loadLog()
+## count = True to add to the alert totals, False to only warm up the state
+def replayRows(state, times, ranges, down, count=True):
+    table = state["table"]
+    fired = state["fired"]
+    on_seconds = state["on_seconds"]
+
+    for x in range(0,len(times)):
+        now = times[x]
+        lowT, highT, lowH, highH, lowL, highL = ranges[x]
+        medianH = round((lowH + highH) / 2, 2)
+        medianL = round((lowL + highL) / 2, 2)
+
+        state["lux_hours"].add(now, medianL)
+        luxHRs = state["lux_hours"].value()
+        state["hum"].add(now, medianH)
+        hum_changed = state["hum"].changed(medianH, sensor_fusion.hum_hrch)
+        error = down[x]
+        state["down"] = np.where(error == 1, state["down"] + 1, 0)
+
+        inputs = np.concatenate(([lowT, highT, lowH, highH, lowL, highL,
+            luxHRs, hum_changed], error, state["down"]))
+        bits = table.check(inputs, now)
+
+        if count:
+            fired += bits & ~state["bits"]
+            if state["time"] is not None:
+                on_seconds += state["bits"] * (now - state["time"])
+            state["rows"] = state["rows"] + 1
+        state["bits"] = bits
+        state["time"] = now
+
+
+# Returns fresh replay state for a log with series_count series
+def newState(series_count):
+    series_list = replaySeries(series_count)
+    rules = sensor_fusion.alertRules(series_list)
+    return {
+        "rules": rules,
+        "table": ThresholdTable(rules, sensor_fusion.alertInputs(series_list)),
+        "lux_hours": LuxHoursIntegrator(sensor_fusion.luxhr_period,
+            sensor_fusion.luxhr_buckets),
+        "hum": RollingMinMax(sensor_fusion.hum_window),
+        "down": np.zeros(series_count, dtype=int),
+        "bits": np.zeros(len(rules), dtype=bool),
+        "time": None,
+        "rows": 0,
+        "fired": np.zeros(len(rules), dtype=int),
+        "on_seconds": np.zeros(len(rules), dtype=float),
+    }
+
+
+# Replays one day file, warmed up with the end of the previous one
+# Returns the day's summary as a dict
+## task = (path, previous path or None, setting overrides)
+def replayDay(task):
+    path, previous, overrides = task
+    applyOverrides(overrides)
+
+    times, ranges, down = loadLog(path)
+    state = newState(down.shape[1])
+
+    if previous is not None and len(times) > 0:
+        warm_times, warm_ranges, warm_down = loadLog(previous)
+        if warm_down.shape[1] == down.shape[1]:
+            # Only the part that can still be inside a window is needed
+            keep = warm_times >= times[0] - max(sensor_fusion.luxhr_period,
+                sensor_fusion.hum_window)
+            replayRows(state, warm_times[keep], warm_ranges[keep],
+                warm_down[keep], count=False)
+
+    replayRows(state, times, ranges, down)
+
+    alerts = []
+    for x in range(0,len(state["rules"])):
+        alerts.append({"led": "L%02d" % (x + 1), "pin": state["rules"][x].pin,
+            "alert": state["rules"][x].message,
+            "fired": int(state["fired"][x]),
+            "on_seconds": float(state["on_seconds"][x])})
+    return {"path": path, "rows": state["rows"], "alerts": alerts}
+
+
+# Returns the date of a log file from its name, for ordering (None if the
+## name has no date)
+def logDate(path):
+    return logPart(path)[0]
+
+# Returns the date and part number of a log file from its name, for ordering
+## A day carried on in numbered files (sensor_log_<date>_1.csv, ...) is part 1
+## onwards, the day's first file is part 0. The date is None if the name has
+## no date.
+def logPart(path):
+    parts = os.path.splitext(os.path.basename(path))[0].split("_")
+    part = 0
+    if len(parts) > 1 and parts[-1].isdigit():
+        part = int(parts[-1])
+        parts = parts[:-1]
+    try:
+        return datetime.strptime(parts[-1], "%b-%d-%Y"), part
+    except ValueError:
+        return None, 0
+
+
+# Replays a set of day files across 'workers' processes
+# Returns the summary of each day, in date order
+## paths = log files to replay
+## overrides = dict of sensor_fusion settings to change for the replay
+## workers = number of processes, defaults to the number of CPUs
+def replayLogs(paths, overrides={}, workers=None):
+    paths = sorted(paths, key=lambda p: (logDate(p) or datetime.max, logPart(p)[1], p))
+    tasks = []
+    for x in range(0,len(paths)):
+        previous = None
+        if x > 0 and logDate(paths[x - 1]) is not None:
+            previous = paths[x - 1]
+        tasks.append((paths[x], previous, overrides))
+
+    if workers == 1 or len(tasks) <= 1:
+        return [replayDay(task) for task in tasks]
+    with multiprocessing.Pool(workers, initializer=quiet) as pool:
+        return pool.map(replayDay, tasks)
+
+
+# Adds the day summaries together
+# Returns one summary for all the days
+def totalSummary(days):
+    total = {"days": len(days), "rows": 0, "alerts": []}
+    for day in days:
+        total["rows"] = total["rows"] + day["rows"]
+        for x in range(0,len(day["alerts"])):
+            if x == len(total["alerts"]):
+                total["alerts"].append(dict(day["alerts"][x], fired=0, on_seconds=0.0))
+            total["alerts"][x]["fired"] += day["alerts"][x]["fired"]
+            total["alerts"][x]["on_seconds"] += day["alerts"][x]["on_seconds"]
+    return total
+
+
+# Turns off trace events in every module, replays run quietly
+def quiet():
+    sensor_fusion.debug = 0
+    trace.close()
+
+
+# Settings that are counts, switches or GPIO pins (the led_ settings), which
+## have to stay whole numbers. Every other numeric setting (thresholds, bands,
+## dwell times, periods) can be set to any number.
+_WHOLE_SETTINGS = set(["luxhr_buckets", "trace_ring", "log_flush_rows", "count",
+    "debug", "stage_timing", "batch_reads", "binary_log", "raw_log"])
+
+# Reads a --set option as a setting name and value
+def parseSetting(text):
+    if "=" not in text:
+        raise argparse.ArgumentTypeError("expected name=value, got %s" % text)
+    name, value = text.split("=", 1)
+    if not isinstance(getattr(sensor_fusion, name, None), (int, float)):
+        raise argparse.ArgumentTypeError("%s is not a numeric setting in sensor_fusion.py" % name)
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s: %s is not a number" % (name, value))
+    if name in _WHOLE_SETTINGS or name.startswith("led_"):
+        if not number.is_integer():
+            raise argparse.ArgumentTypeError("%s must be a whole number" % name)
+        number = int(number)
+    return name, number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay sensor logs through the alert stages")
+    parser.add_argument("paths", nargs="+", help="CSV logs, binary logs or raw captures")
+    parser.add_argument("--set", dest="settings", action="append", default=[],
+        type=parseSetting, metavar="NAME=VALUE",
+        help="change a sensor_fusion.py setting for the replay, e.g. temp_hs=22")
+    parser.add_argument("--workers", type=int,
+        help="number of processes (default: number of CPUs)")
+    parser.add_argument("--json", action="store_true",
+        help="print the summaries as JSON lines instead of a table")
+    args = parser.parse_args(argv)
+
+    quiet()
+    days = replayLogs(args.paths, dict(args.settings), args.workers)
+    total = totalSummary(days)
+
+    if args.json:
+        for day in days:
+            sys.stdout.write(json.dumps(day) + "\n")
+        sys.stdout.write(json.dumps(total) + "\n")
+        return
+
+    print("Replayed %d rows from %d log files" % (total["rows"], total["days"]))
+    print("%-4s %6s %10s  %s" % ("LED", "Fired", "Hours On", "Alert"))
+    for alert in total["alerts"]:
+        print("%-4s %6d %10.2f  %s" % (alert["led"], alert["fired"],
+            alert["on_seconds"] / 3600, alert["alert"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# Asynchronous Runtime
+#
+# Runs the same stages as the loop in sensor_fusion.py, but as separate asyncio
+## tasks joined by bounded queues, so a slow stage can't hold up the others:
+#
+#   acquire -> fuse -> alert       LED states (GPIO)
+#                   -> log         CSV log, binary log, raw capture
+#                   -> telemetry   collector, metrics endpoint
+#
+# Acquisition keeps to the fixed-rate grid of FixedRateScheduler and hands each
+## cycle's readings on as soon as they are in. Work that blocks (bus reads, GPIO
+## writes, disk writes) runs on worker threads, one per kind of work so each
+## keeps its order, and the event loop only waits on it. Fusion and the alert
+## rules run on the event loop itself, as they only take microseconds.
+# Each queue holds at most queue_size cycles. If a stage falls that far behind
+## (e.g. the SD card stalls on a write), the oldest cycle in its queue is
+## dropped and counted, rather than the next sample being delayed. Only the
+## latest LED state matters, so the alert queue drops without losing anything.
+## Cycles still queued for the log when the runtime is stopped are written out.
+# With stage timing on (see timing.py), each task times its own work, and the
+## "cycle" time runs from the start of acquisition to the end of fusion.
+#
+# Usage:
+##  python3 -m redundant_sensor.runtime
+##  python3 -m redundant_sensor.runtime --period 0.5
+##  SENSOR_BACKEND=sim python3 -m redundant_sensor.runtime --period 0.1 --queue-size 50
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . import sensor_fusion
+from . import timing
+from . import trace
+from .scheduler import FixedRateScheduler
+
+# Most cycles each queue holds before the oldest is dropped
+queue_size = 100
+
+
+# Runs the sensor fusion stages as asyncio tasks
+## acquirer = the SeriesAcquirer from sensor_fusion.startup()
+## period = seconds between the start of each cycle
+## queue_size = most cycles each queue holds before the oldest is dropped
+class Runtime:
+
+    def __init__(self, acquirer, period, queue_size=queue_size):
+        self.acquirer = acquirer
+        self.period = period
+        self.queue_size = queue_size
+        self.schedule = FixedRateScheduler(period)
+        # One worker thread for each kind of blocking work, so bus reads, LED
+        ## writes and disk writes each stay in order
+        self.bus = ThreadPoolExecutor(max_workers=1, thread_name_prefix="acquire")
+        self.gpio = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpio")
+        self.disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log")
+        # Queues are created by run(), on the event loop that uses them
+        self.queues = {}
+        # Cycles dropped from each queue
+        self.dropped = {"fuse": 0, "alert": 0, "log": 0, "telemetry": 0}
+        self.cycles = 0
+        self.late = 0
+        self.closed = False
+
+    # Returns True if the cycles need to go to the telemetry task
+    def _telemetry(self):
+        return (sensor_fusion.collector_client is not None or
+            sensor_fusion.metrics_server is not None)
+
+    # Puts a cycle on a queue without waiting, dropping the oldest cycle in
+    ## the queue if it is full
+    def _offer(self, name, cycle):
+        queue = self.queues[name]
+        if queue.full():
+            queue.get_nowait()
+            self.dropped[name] = self.dropped[name] + 1
+            if trace.level <= trace.WARN:
+                trace.event(trace.WARN, "runtime",
+                    "The %s queue is full, oldest cycle dropped" % name, queue=name)
+        queue.put_nowait(cycle)
+
+    # Reads every series once per period and queues the readings for fusion
+    async def acquireTask(self):
+        loop = asyncio.get_running_loop()
+        self.schedule.start()
+        while True:
+            # Wall-clock time of this cycle, used for the Lux Hours and
+            ## Humidity windows
+            now = time.time()
+            start = time.monotonic()
+            readings = await loop.run_in_executor(self.bus, self.acquirer.acquire,
+                sensor_fusion.series_list)
+            if timing.enabled:
+                timing.record("acquire", time.monotonic() - start)
+            self._offer("fuse", {"now": now, "start": start,
+                "stamp": datetime.now(), "readings": readings})
+
+            # Disabling Channels to ensure fresh start in next loop
+            sensor_fusion.disableStage(self.acquirer)
+
+            delay, self.late = self.schedule.advance()
+            if self.late > 0 and trace.level <= trace.WARN:
+                trace.event(trace.WARN, "runtime",
+                    "Cycle overran its %0.1f second period by %0.2f seconds" %
+                    (self.period, self.late), period=self.period, late=self.late)
+            await asyncio.sleep(delay)
+
+    # Fuses each cycle's readings, checks the alert rules and hands the cycle
+    ## on to the alert, log and telemetry tasks
+    async def fuseTask(self):
+        sf = sensor_fusion
+        queue = self.queues["fuse"]
+        while True:
+            cycle = await queue.get()
+            laps = timing.Laps()
+            now = cycle["now"]
+            temp_intervals, hum_intervals, lux_intervals = sf.readStage(cycle["readings"])
+
+            if trace.level <= trace.DEBUG:
+                trace.event(trace.DEBUG, "fuse",
+                    "\nApplying Marzullo's Algorithm returns the following results:")
+            lowL, highL, medianL, luxMA = sf.fuseStage(lux_intervals, 2)
+            luxHRs = sf.luxHoursStage(now, medianL)
+            lowT, highT, medianT, tempMA = sf.fuseStage(temp_intervals, 0)
+            lowH, highH, medianH, humMA = sf.fuseStage(hum_intervals, 1)
+            hum_changed = sf.humidityStage(now, medianH)
+
+            cycle["fused"] = [(lowT, highT, medianT, tempMA),
+                (lowH, highH, medianH, humMA), (lowL, highL, medianL, luxMA)]
+            cycle["counts"] = [len(temp_intervals), len(hum_intervals), len(lux_intervals)]
+            cycle["lux_hours"] = luxHRs
+            cycle["hum_changed"] = hum_changed
+            cycle["led_state"] = sf.alertStage(now, lowT, highT, lowH, highH,
+                lowL, highL, luxHRs, hum_changed)
+            # The series status is copied, the next cycle's readStage updates
+            ## it before the later stages may have used this one
+            cycle["errors"] = list(sf.sensor_error)
+            cycle["down"] = list(sf.sensor_down)
+            laps.lap("fuse")
+            cycle["cycle_seconds"] = time.monotonic() - cycle["start"]
+            self.cycles = self.cycles + 1
+            if timing.enabled:
+                timing.record(timing.CYCLE, cycle["cycle_seconds"])
+                sf.timingStage(time.monotonic())
+
+            self._offer("alert", cycle)
+            self._offer("log", cycle)
+            if self._telemetry():
+                self._offer("telemetry", cycle)
+
+    # Sets the LEDs to each cycle's alert state
+    async def alertTask(self):
+        loop = asyncio.get_running_loop()
+        queue = self.queues["alert"]
+        while True:
+            cycle = await queue.get()
+            await loop.run_in_executor(self.gpio, self.setLeds, cycle["led_state"])
+
+    # Writes only the LEDs that changed
+    def setLeds(self, led_state):
+        laps = timing.Laps()
+        sensor_fusion.led_bank.setState(led_state)
+        sensor_fusion.led_bank.apply()
+        laps.lap("gpio")
+
+    # Writes each cycle to the log files
+    async def logTask(self):
+        loop = asyncio.get_running_loop()
+        queue = self.queues["log"]
+        while True:
+            cycle = await queue.get()
+            await loop.run_in_executor(self.disk, self.writeLogs, cycle)
+
+    # Writes one cycle to the raw capture, CSV log and binary log
+    def writeLogs(self, cycle):
+        laps = timing.Laps()
+        if sensor_fusion.raw_capture is not None:
+            sensor_fusion.raw_capture.write(cycle["stamp"], cycle["readings"])
+        medianT = cycle["fused"][0][2]
+        medianH = cycle["fused"][1][2]
+        medianL = cycle["fused"][2][2]
+        sensor_fusion.logStage(cycle["stamp"], medianT, medianH, medianL,
+            cycle["lux_hours"], cycle["led_state"], cycle["errors"])
+        laps.lap("log")
+
+    # Sends each cycle to the collector and the metrics endpoint
+    async def telemetryTask(self):
+        sf = sensor_fusion
+        queue = self.queues["telemetry"]
+        while True:
+            cycle = await queue.get()
+            laps = timing.Laps()
+            if sf.collector_client is not None:
+                sf.collectorStage(cycle["now"], cycle["fused"], cycle["counts"],
+                    cycle["lux_hours"], cycle["led_state"], cycle["errors"])
+                laps.lap("collector")
+            if sf.metrics_server is not None:
+                timings = {"period": self.period,
+                    "cycle_seconds": cycle["cycle_seconds"],
+                    "late_seconds": self.late, "cycles": self.cycles,
+                    "overruns": self.schedule.overruns, "missed": self.schedule.missed}
+                sf.metrics_server.publish(sf.metricsSnapshot(cycle["now"],
+                    cycle["fused"], cycle["lux_hours"], cycle["hum_changed"],
+                    cycle["led_state"], timings, cycle["errors"], cycle["down"]))
+                laps.lap("metrics")
+
+    # Runs every task until one fails or the runtime is cancelled
+    async def run(self):
+        for name in self.dropped:
+            self.queues[name] = asyncio.Queue(self.queue_size)
+        tasks = [self.acquireTask(), self.fuseTask(), self.alertTask(), self.logTask()]
+        if self._telemetry():
+            tasks.append(self.telemetryTask())
+        await asyncio.gather(*tasks)
+
+    # Stops the worker threads and writes out the cycles still queued for
+    ## the log
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.bus.shutdown(wait=False)
+        self.gpio.shutdown(wait=True)
+        self.disk.shutdown(wait=True)
+        queue = self.queues.get("log")
+        while queue is not None and not queue.empty():
+            self.writeLogs(queue.get_nowait())
+        if sum(self.dropped.values()) > 0 and trace.level <= trace.WARN:
+            trace.event(trace.WARN, "runtime", "Cycles dropped: %s" %
+                ", ".join("%s %d" % (name, self.dropped[name])
+                for name in self.dropped if self.dropped[name] > 0),
+                dropped=dict(self.dropped))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the sensor fusion stages as asyncio tasks")
+    parser.add_argument("--period", type=float, default=sensor_fusion.loop_period,
+        help="seconds between cycles (default: loop_period in sensor_fusion.py)")
+    parser.add_argument("--queue-size", type=int, default=queue_size,
+        help="most cycles each queue holds before the oldest is dropped")
+    args = parser.parse_args(argv)
+
+    sensor_fusion.loop_period = args.period
+    acquirer = sensor_fusion.startup()
+    runtime = Runtime(acquirer, args.period, args.queue_size)
+    try:
+        asyncio.run(runtime.run())
+    except KeyboardInterrupt:
+        runtime.close()
+        sensor_fusion.led_bank.cleanup()
+        print("\n")
+    finally:
+        runtime.close()
+        sensor_fusion.shutdown(acquirer)
+
+
+if __name__ == "__main__":
+    main()
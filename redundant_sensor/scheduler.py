@@ -0,0 +1,61 @@
+# Fixed-Rate Loop Scheduler
+#
+# Holds the main loop to a fixed period. Sleeping a fixed amount at the end of
+## each cycle makes the real period the sleep time plus however long the cycle
+## took, so timestamps drift. Instead, each cycle is given a deadline on a fixed
+## grid (start, start + period, start + 2*period, ...) measured with the
+## monotonic clock, and the loop only sleeps for whatever is left until it.
+# If a cycle runs past its deadline it is reported as an overrun. The next
+## cycle starts straight away, and any whole slots that were missed are skipped
+## so the loop picks the grid back up instead of running several cycles back
+## to back to catch up.
+
+import time
+
+
+# Schedules loop cycles at a fixed rate
+## period = seconds between the start of each cycle
+class FixedRateScheduler:
+
+    def __init__(self, period):
+        self.period = period
+        self.next_deadline = None
+        # Number of cycles that ran past their deadline
+        self.overruns = 0
+        # Number of grid slots skipped because of overruns
+        self.missed = 0
+
+    # Starts the grid from the current time. Called once before the first
+    ## cycle, wait() will also do this if it hasn't been done.
+    def start(self):
+        self.next_deadline = time.monotonic() + self.period
+
+    # Moves on to the next cycle without sleeping, for loops that do their own
+    ## sleeping (e.g. with asyncio.sleep)
+    # Returns the seconds left until the next cycle starts, and how many
+    ## seconds the cycle overran its deadline by (0 if on time)
+    def advance(self):
+        if self.next_deadline is None:
+            self.start()
+
+        now = time.monotonic()
+        late = now - self.next_deadline
+        if late <= 0:
+            self.next_deadline = self.next_deadline + self.period
+            return -late, 0
+
+        # Overrun: starting now and moving the deadline to the next slot on
+        ## the grid that is still ahead
+        skipped = int(late // self.period) + 1
+        self.overruns = self.overruns + 1
+        self.missed = self.missed + skipped - 1
+        self.next_deadline = self.next_deadline + skipped * self.period
+        return 0, late
+
+    # Sleeps until the start of the next cycle
+    # Returns how many seconds the cycle overran its deadline by (0 if on time)
+    def wait(self):
+        delay, late = self.advance()
+        if delay > 0:
+            time.sleep(delay)
+        return late
@@ -0,0 +1,785 @@
+# Sensor Fusion using Marzullo's Algorithm
+#
+# Current Functionality:
+# Takes in readings from each set of sensors using the MUX channels. The sets
+## of sensors (series) are listed in series.json, 3 are currently in use.
+# Outputs the results to the screen when debug mode is enabled.
+# Using the known precision, creates pairs at the outer bounds of the precision
+## for each reading to make a range of precision.
+# Passes the Precision Range Pairs to a function that performs Marzullo's
+## Algorithm and returns the resulting new range.
+# New Precision is now also printed (found by taking the difference between the
+## upper and lower bound of the new range and dividing in half)
+# Median value of the new range is also found
+# Lower and Upper bounds of new range is used to test against LED triggers
+# Writes Date, Time, Temp, and Humidity Readings, Sensor Status, and LED states
+## to CSV file. Rows are buffered and appended to the day's file in batches.
+# A new log file is created each day, starting exactly at midnight.
+# If humidity has an absolute change of greater than 10% per hour, Alert is
+## triggered.
+# Alert is produced if current light exposure is greater than 200 lux
+# Alert is produced if daily light exposure greater than 1000 lux hours
+# Debug Mode implemented: If debug set to 1, print states will execute to aid in
+## debugging.
+## The prints are trace events (see trace.py), which can also be kept in
+## memory or written to a file, with or without debug mode.
+# Alert is produced when any sensor in a series fails.
+# Alert is produced when a specific sensor series remains down for 3 cycles
+# Overall Loop is intended to run once per minute. For demonstration purposes,
+## loop_period can be changed to run more frquently. The period is held on a
+## fixed schedule, independent of how long each cycle takes.
+#
+# Customizing Functionality:
+## Sensor Thresholds have been set as variable values to allow easy adjustment
+## to suit any implementation.
+## Each threshold also has a hysteresis band and a minimum dwell time, so a
+## reading hovering around a threshold doesn't flick its LED on and off.
+#
+# Running:
+## python3 sensor_fusion.py (the launcher in the project folder), or call main()
+## Importing this module doesn't touch the hardware or start the loop. The
+## hardware libraries are imported when the backend is created, and the binary
+## log, raw capture, collector and metrics modules only when startup() turns
+## them on, so analysis tools can import the stages cheaply.
+
+import time
+import os
+from datetime import datetime
+from . import hardware
+from . import timing
+from . import trace
+from . import config
+from .marzullo import marzulloSweep, MarzulloTracker
+from .log_writer import LogWriter, logHeaders
+from .scheduler import FixedRateScheduler
+from .acquisition import SeriesAcquirer
+from .leds import LedBank
+from .thresholds import AlertRule, ThresholdTable, packBits
+from .windows import RollingMinMax, LuxHoursIntegrator
+
+
+# Sets Debug Mode (1 = On)
+## Set to 0 to disable Print Statements
+## Prints the trace events (see trace.py) to the screen as they happen
+debug = 1
+
+# Trace logging (see trace.py)
+## trace_level = lowest level of event recorded: "off", "error", "warn",
+##               "info", "debug" or "trace". Levels below it cost nothing.
+##               Warnings (series down, timeouts, overruns) are kept even
+##               with debug mode off. Can also be set with the SENSOR_TRACE
+##               environment variable
+## trace_ring = number of recent events kept in memory (served on /trace by
+##              the metrics endpoint)
+## trace_file = JSON lines file the events are also appended to, None for no
+##              file. Can also be set with the SENSOR_TRACE_FILE environment
+##              variable
+trace_level = os.environ.get("SENSOR_TRACE", "debug" if debug == 1 else "warn")
+trace_ring = 1000
+trace_file = os.environ.get("SENSOR_TRACE_FILE")
+
+# Stage timing (see timing.py)
+## stage_timing = times each stage of the loop, and each series read (1 = On)
+## timing_interval = seconds between summaries of the stage times (p50, p95,
+##                   p99, max), which are traced at info level and served by
+##                   the metrics endpoint
+stage_timing = 1
+timing_interval = 60
+
+# Hardware backend
+## "pi" = sensors, MUX and LEDs on the Raspberry Pi
+## "sim" = simulated sensors, to run without the hardware
+## Can also be set with the SENSOR_BACKEND environment variable
+sensor_backend = os.environ.get("SENSOR_BACKEND", "pi")
+
+# Multi-site collector (see collector.py) to send each cycle's readings to
+## Given as "host:port", None to run stand-alone
+## Can also be set with the SENSOR_COLLECTOR environment variable
+collector_address = os.environ.get("SENSOR_COLLECTOR")
+
+# Port of the live metrics endpoint (see metrics.py), 0 to turn it off
+## Serves /metrics (Prometheus) and /json from a background thread
+## Can also be set with the SENSOR_METRICS_PORT environment variable
+metrics_port = int(os.environ.get("SENSOR_METRICS_PORT", "0"))
+
+# Sensor Series configuration file (see config.py for the format)
+## Lists the MUX address, channel, sensor types, precision and LEDs of each
+## series. Can also be set with the SENSOR_SERIES environment variable
+## Loaded by startup() (see loadConfig()), not when this module is imported
+series_config = os.environ.get("SENSOR_SERIES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "series.json"))
+
+# LED GPIO
+## Temp Greather/Less than Soft/Hard Thresholds
+led_temp_gthard = 26
+led_temp_gtsoft = 21
+led_temp_ltsoft = 19
+led_temp_lthard = 20
+## Hum Greather/Less than Soft/Hard Thresholds
+led_hum_gthard = 16
+led_hum_gtsoft = 13
+led_hum_ltsoft = 6
+led_hum_lthard = 12
+## Humidity Change >10% /hr
+led_hum_chng = 5
+## Current Lux threshold Exceeded
+led_lux_gt = 7
+## LuxHours threshold over 24hrs Exceeded
+led_luxhr_gt = 8
+## Series Currently Down / Down for 3 or more Cycles
+## Set per series in the Sensor Series configuration file
+## Fixed alert LED pins, which the series LEDs can't share
+fixed_leds = [led_temp_gthard, led_temp_gtsoft, led_temp_ltsoft, led_temp_lthard,
+    led_hum_gthard, led_hum_gtsoft, led_hum_ltsoft, led_hum_lthard, led_hum_chng,
+    led_lux_gt, led_luxhr_gt]
+
+# Configured sensor series, loaded by loadConfig()
+series_list = []
+
+# Loop period in seconds
+## Set to 60 for the intended rate of once per minute. A shorter period can be
+## used for demonstration purposes.
+loop_period = 5
+
+# Seconds allowed for each series read before it is marked as down
+## Series on the same I2C bus are read one at a time, separate buses in parallel
+series_timeout = 2
+
+# Reads the series on each I2C bus together, starting every HTU31D conversion
+## before collecting any, so the series wait for one conversion instead of one
+## each (1 = On)
+batch_reads = 1
+
+# Log file buffering
+## Rows are written to disk once this many are waiting, or once the oldest has
+## waited this many seconds, whichever comes first
+log_flush_rows = 10
+log_flush_interval = 60
+# Also writes each cycle to a compact binary log (1 = On), see binlog.py
+binary_log = 0
+# Records every series' own readings before fusion (1 = On), see rawlog.py
+## Oldest raw files are deleted once they take up more than raw_log_max_mb
+raw_log = 0
+raw_log_max_mb = 64
+
+# Marzullo's Algorithm
+## With this many series or more, each quantity is fused by a tracker that
+## keeps the previous cycle's sorted endpoints and only moves the ones whose
+## readings changed. Below it the plain sweep is quicker.
+tracker_min_series = 16
+fusion_trackers = [MarzulloTracker(0), MarzulloTracker(1), MarzulloTracker(2)]
+
+# Cumulative Lux Hours over the last 24hrs
+## Each reading is weighted by the time since the previous one and kept in
+## luxhr_buckets time slices, so the total rolls forward at any loop period
+luxhr_period = 24 * 60 * 60
+luxhr_buckets = 1440
+lux_hours = LuxHoursIntegrator(luxhr_period, luxhr_buckets)
+
+# Loop Counter
+count = 0
+
+# Indicates current status of each sensor series
+# Set to 1 each time sensor is down, triggers LED at 1
+sensor_error = []
+# Indicates historic status of each sensor series
+# Increments when sensor_error is 1, triggers LED at 3
+sensor_down = []
+
+# Humidity Values over the last hour to check for >10% change
+## Only the rolling min/max of the last hum_window seconds is kept, so the check
+## costs the same at any loop period
+hum_window = 60 * 60
+hum_over_hour = RollingMinMax(hum_window)
+
+# Sensor Thresholds based on Specifications
+## Temperature Thresholds (degrees Celsius)
+temp_lh = 20    # low/hard threshold
+temp_ls = 20.5  # low/soft threshold
+temp_hs = 21.5  # high/soft threshold
+temp_hh = 22    # high/hard threshold
+## Relative Humidity Thresholds (Percentage)
+hum_lh = 35.0   # low/hard threshold
+hum_ls = 40.0   # low/soft threshold
+hum_hs = 50.0   # high/soft threshold
+hum_hh = 55.0   # high/hard threshold
+hum_hrch = 10   # low/hard threshold
+## Lux & LuxHrs Thresholds
+lux_max = 200
+luxhr_max = 1000
+
+# Alert Hysteresis and Debounce
+## Once an alert is on, the reading has to come back past the threshold by the
+## band before it turns off again
+temp_band = 0.1     # degrees Celsius
+hum_band = 1.0      # percentage relative humidity
+lux_band = 10       # lux
+luxhr_band = 10     # lux hours
+## Seconds a threshold has to stay crossed (or cleared) before its LED changes
+alert_dwell = 10
+
+# Sensor Thresholds based on Demo Requirement
+#temp_baseline = 0#current room value
+#hum_baseline = 0#current room value
+#lux_baseline = 0#current room value
+## Temperature Thresholds (degrees Celsius)
+#temp_lh = temp_baseline + 4    # low/hard threshold
+#temp_ls = temp_baseline + 8  # low/soft threshold
+#temp_hs = temp_baseline + 12  # high/soft threshold
+#temp_hh = temp_baseline + 16    # high/hard threshold
+## Relative Humidity Thresholds (Percentage)
+#hum_lh = 10   # low/hard threshold
+#hum_ls = -5   # low/soft threshold
+#hum_hs = +10   # high/soft threshold
+#hum_hh = +15   # high/hard threshold
+#hum_hrch = 10   # low/hard threshold
+## Lux & LuxHrs Thresholds
+#lux_max = lux_baseline * 5
+#luxhr_max = lux_baseline * 10
+
+# MUX addresses in use on each I2C bus, filled in on startup
+bus_addresses = {}
+# Hardware backend (MUX, sensors and LEDs), created on startup
+backend = None
+# Log file writer, created on startup
+log = None
+# LED bank (state of every LED pin), created on startup
+led_bank = None
+# Binary log file writer, created on startup if binary_log is on
+bin_log = None
+# Raw reading writer, created on startup if raw_log is on
+raw_capture = None
+# Connection to the collector, created on startup if collector_address is set
+collector_client = None
+# Live metrics endpoint, created on startup if metrics_port is set
+metrics_server = None
+# Monotonic time the next stage timing summary is due, set by the first
+## timingStage()
+timing_due = None
+
+
+# Returns the names of the values the alert rules are checked against
+## The fused ranges, Lux Hours and humidity change come first, then the
+## error and down counts of each series
+def alertInputs(series_list):
+    inputs = ["lowT", "highT", "lowH", "highH", "lowL", "highL", "luxHRs",
+    "hum_changed"]
+    inputs = inputs + ["error %d" % s.number for s in series_list]
+    inputs = inputs + ["down %d" % s.number for s in series_list]
+    return inputs
+
+# Returns the alert rule for every LED, in the order they are logged
+## The fixed alert LEDs come first, then each series' error LED, then each
+## series' down LED, for the series that have them
+def alertRules(series_list):
+    rules = [
+        AlertRule(led_temp_gthard, "highT", ">", temp_hh,
+            band=temp_band, dwell=alert_dwell,
+            message="Above Hard Range of Acceptable Temp"),
+        AlertRule(led_temp_gtsoft, "highT", ">", temp_hs,
+            band=temp_band, dwell=alert_dwell,
+            message="Above Soft Range of Acceptable Temp"),
+        AlertRule(led_temp_ltsoft, "lowT", "<", temp_ls,
+            band=temp_band, dwell=alert_dwell,
+            message="Below Soft Range of Acceptable Temp"),
+        AlertRule(led_temp_lthard, "lowT", "<", temp_lh,
+            band=temp_band, dwell=alert_dwell,
+            message="Below Hard Range of Acceptable Temp"),
+        AlertRule(led_hum_gthard, "highH", ">", hum_hh,
+            band=hum_band, dwell=alert_dwell,
+            message="Above Hard Range of Acceptable Relative Humidity"),
+        AlertRule(led_hum_gtsoft, "highH", ">", hum_hs,
+            band=hum_band, dwell=alert_dwell,
+            message="Above Soft Range of Acceptable Relative Humidity"),
+        AlertRule(led_hum_ltsoft, "lowH", "<", hum_ls,
+            band=hum_band, dwell=alert_dwell,
+            message="Below Soft Range of Acceptable Relative Humidity"),
+        AlertRule(led_hum_lthard, "lowH", "<", hum_lh,
+            band=hum_band, dwell=alert_dwell,
+            message="Below Hard Range of Acceptable Relative Humidity"),
+        AlertRule(led_hum_chng, "hum_changed", ">", 0,
+            dwell=alert_dwell,
+            message="Relative Humidity has changed more than 10% within an hour"),
+        # highL is never below lowL, so this covers either being over
+        AlertRule(led_lux_gt, "highL", ">", lux_max,
+            band=lux_band, dwell=alert_dwell,
+            message="Above Acceptable Level of Lux"),
+        AlertRule(led_luxhr_gt, "luxHRs", ">", luxhr_max,
+            band=luxhr_band, dwell=alert_dwell,
+            message="Above Acceptable Level of Lux Hours within 24 hours")]
+    # Series down for the current cycle
+    rules = rules + [AlertRule(s.led_error, "error %d" % s.number, ">", 0,
+        message="%s down" % s) for s in series_list if s.led_error is not None]
+    # Series down for 3 consecutive cycles, does not reset once triggered
+    rules = rules + [AlertRule(s.led_down, "down %d" % s.number, ">", 2,
+        latch=True, message="%s down 3 times in a row" % s)
+        for s in series_list if s.led_down is not None]
+    return rules
+
+# Returns the list of all LED GPIO pins, in the order they are logged
+def ledList(series_list):
+    return [rule.pin for rule in alertRules(series_list)]
+
+# Alert rules, compiled once for the configured series by loadConfig()
+alert_table = None
+# List of all LED GPIO pins, set by loadConfig()
+led_list = []
+
+# Loads the Sensor Series configuration file and compiles the alert rules for
+## its series, setting series_list, alert_table, led_list, sensor_error and
+## sensor_down
+# Raises OSError if the file can't be read, ValueError if it isn't valid
+def loadConfig():
+    global series_list, alert_table, led_list, sensor_error, sensor_down
+    series_list = config.loadSeries(series_config, fixed_leds)
+    alert_table = ThresholdTable(alertRules(series_list), alertInputs(series_list))
+    led_list = ledList(series_list)
+    sensor_error = [0] * len(series_list)
+    sensor_down = [0] * len(series_list)
+
+# Each stage of the main loop is kept in its own function below, so the stages
+## can also be run and timed on their own (see benchmark.py)
+
+########################################################################
+# Sensor Reading Stage:                                                #
+# Each Sensor Series is read by opoening the relevant mux channel,     #
+# reading in the data, then closing the channel and returning the data #
+# to the main script. Series are read concurrently by the acquirer,    #
+# and a series that isn't read within series_timeout is marked down.   #
+# Each set of readings is then adjusted into an upper and lower bound  #
+# based on the known precision of the sensors. Then added as a pair to #
+# a list of tuples. One list each for temp, humidity and lux           #
+# The up/down status of the sensors is also returned. If one sensor in #
+# a series is down, the entire series is treated as down for the rest  #
+# of the loop.                                                         #
+########################################################################
+
+# Turns the readings of each series into precision ranges and updates the
+## sensor_error/sensor_down status of each series
+# A series without a sensor type (reading of None) adds no range for it
+# Returns temp_intervals, hum_intervals, lux_intervals
+## readings = list of (temperature, relative_humidity, lux, up_down), one per
+##            series in series_list, as returned by the acquirer
+def readStage(readings):
+    temp_intervals = []
+    hum_intervals = []
+    lux_intervals = []
+
+    # Read Sensors from each channel and account for precision error
+    for x in range(0,len(readings)):
+        temperature, relative_humidity, lux, sensor_error[x] = readings[x]
+        s = series_list[x]
+        if (sensor_error[x] == 0):
+            sensor_down[x] = 0
+            if temperature is not None:
+                temp_intervals.append([float(temperature) - s.temp_precision,
+                    float(temperature) + s.temp_precision])
+                hum_intervals.append([float(relative_humidity) - s.hum_precision,
+                    float(relative_humidity) + s.hum_precision])
+            if lux is not None:
+                lux_intervals.append([float(lux) - float(lux*s.lux_precision),
+                    float(lux) + float(lux*s.lux_precision)])
+        else:
+            sensor_down[x] = sensor_down[x] + sensor_error[x]
+
+    return temp_intervals, hum_intervals, lux_intervals
+
+########################################################################
+# Marzullo's Algorithm Stage:                                          #
+# Sensor readings are sent to the marzulloSweep function as a series   #
+# of intervals. If only 1 sensor is up, that sensor's reading is the   #
+# resulting low/high values. If no sensors are up, low/high values are #
+# set to 0. From the low/high values, the new precision and median     #
+# values are found. The low/high values are used to check against LED  #
+# triggers, except for Cummulative LuxHrs, which uses the median lux   #
+# value, and the change in Humidity over an hour period.               #
+########################################################################
+
+# Fuses one quantity's precision ranges into a single range
+# Returns low, high, median, precision. Lux precision is a percentage of the
+## median, temperature and humidity precision are in their own units.
+## intervals = the precision ranges of each series that is up
+## t = The type of data (0 = temp, 1 = humidity, 2 = lux)
+def fuseStage(intervals, t):
+    if len(intervals) >= tracker_min_series:
+        low, high, support = fusion_trackers[t].fuse(intervals)
+    else:
+        low, high, support = marzulloSweep(intervals, len(intervals), t)
+
+    # Finding Median value
+    median = (low+high)/2
+    median = round(median, 2)
+    # Finding new Precision variance
+    if t == 2:
+        if median == 0:
+            precision = 0
+        else:
+            precision = ((high - low)/2)/median * 100
+    else:
+        precision = (high - low)/2
+    precision = round(precision, 2)
+
+    if trace.level <= trace.DEBUG:
+        if (t == 0):
+            message = ("\tTemperature Precision is now: +/- %0.1f C\n"
+                "\tMedian Temperature is: %0.1f C" % (precision, median))
+        elif (t == 1):
+            message = ("\tRelative Humidity Precision is now: +/- %0.1f%%\n"
+                "\tMedian Relative Humidity is: %0.1f%%\n" % (precision, median))
+        else:
+            message = ("\tLux Precision is now: +/- %0.1f%%\n"
+                "\tMedian Lux is: %0.1f" % (precision, median))
+        trace.event(trace.DEBUG, "fuse", message,
+            quantity=("temperature", "humidity", "lux")[t], median=median,
+            precision=precision, sources=len(intervals))
+
+    return low, high, median, precision
+
+# Adds the current Lux to the rolling 24hr total for the Lux Hours Value
+# Returns the Lux Hours over the last 24hrs
+## now = wall-clock time of the reading
+## medianL = fused lux reading
+def luxHoursStage(now, medianL):
+    lux_hours.add(now, medianL)
+    luxHRs = round(lux_hours.value(), 2)
+    if trace.level <= trace.DEBUG:
+        trace.event(trace.DEBUG, "lux_hours", "\tCumulative Lux Hours is: %s" % luxHRs,
+            lux_hours=luxHRs)
+
+    return luxHRs
+
+# Adds the current humidity to the hour window and checks whether relative
+## humidity has changed more than hum_hrch within it
+# Returns True if it has
+## now = wall-clock time of the reading
+## medianH = fused humidity reading
+def humidityStage(now, medianH):
+    hum_over_hour.add(now, medianH)
+    return hum_over_hour.changed(medianH, hum_hrch)
+
+########################################################################
+# LED/Actuator Driver Stage:                                           #
+# Values found using Marzullo's Algorithm are compared against the set #
+# thresholds. If they exceed the threshold, the relevant LED is set to #
+# high. Else it is set back to low. Every threshold is a row in the    #
+# alert rule table, and all rows are checked in one pass. The LED      #
+# states are held as one bit vector and only the pins that changed     #
+# since the last cycle are written. The same bit vector is recorded in #
+# the Log file.                                                        #
+########################################################################
+# Checks the fused values and the series status against the alert rules
+# Returns the LED state bit vector
+## now = wall-clock time of the readings
+## lowT/highT, lowH/highH, lowL/highL = fused temperature, humidity, lux ranges
+## luxHRs = Cumulative Lux Hours
+## hum_changed = True if humidity changed more than hum_hrch within the hour
+def alertStage(now, lowT, highT, lowH, highH, lowL, highL, luxHRs, hum_changed):
+    # Testing Marzullo Output against Thresholds to determine if alert is triggered
+    values = [lowT, highT, lowH, highH, lowL, highL, luxHRs, hum_changed]
+    values = values + sensor_error + sensor_down
+    return packBits(alert_table.check(values, now))
+
+# Sets each LED from the fused values and the series status
+# Returns the LED state bit vector for the Log file
+## Arguments are the same as alertStage
+def ledStage(now, lowT, highT, lowH, highH, lowL, highL, luxHRs, hum_changed):
+    led_bank.setState(alertStage(now, lowT, highT, lowH, highH, lowL, highL,
+        luxHRs, hum_changed))
+
+    # Writing only the LEDs that changed
+    if timing.enabled:
+        start = time.perf_counter()
+    led_bank.apply()
+    if timing.enabled:
+        timing.record("gpio", time.perf_counter() - start)
+
+    return led_bank.state
+
+# Disables the MUX channels to ensure a fresh start in the next cycle
+## Queued on the bus worker so it can't cut into a read still running
+## acquirer = the SeriesAcquirer reading the series
+def disableStage(acquirer):
+    for bus in bus_addresses:
+        if not acquirer.busy(bus):
+            acquirer.run(bus, backend.disableAll, bus_addresses[bus], bus)
+
+# Writes the cycle's fused values, series status and LED states to the log
+## dateTimeObj = datetime of the cycle
+## medianT, medianH, medianL = fused temperature, humidity, lux
+## luxHRs = Cumulative Lux Hours
+## led_state = LED state bit vector from ledStage
+## errors = status of each series, defaults to this cycle's sensor_error
+def logStage(dateTimeObj, medianT, medianH, medianL, luxHRs, led_state, errors=None):
+    if errors is None:
+        errors = sensor_error
+    timeObj = dateTimeObj.time()
+    dateObj = dateTimeObj.date()
+
+    # Setting Values for Sensor Status In Log file
+    sensor_log = [None] * len(errors)
+    stat_count = 0
+    for x in errors:
+        if x == 0:
+            sensor_log[stat_count] = "Up"
+        else:
+            sensor_log[stat_count] = "Down"
+        stat_count = stat_count + 1
+
+    # Formatting data and writing it to log file.
+    list = [dateObj.strftime("%b-%d-%Y"), timeObj.strftime("%H:%M:%S.%f"),
+    medianT, medianH, medianL, luxHRs] + sensor_log + led_bank.bits(led_state)
+    log.write(list, dateTimeObj)
+    if bin_log is not None:
+        bin_log.write(dateTimeObj, medianT, medianH, medianL, luxHRs,
+            packBits(errors), led_state)
+
+########################################################################
+# Collector Stage:                                                     #
+# The cycle's fused ranges are queued for the collector and sent in    #
+# the background. A quantity no series could read is sent as null.     #
+########################################################################
+# Queues the cycle's readings for the collector
+## now = wall-clock time of the readings
+## fused = (low, high, median, precision) of temperature, humidity and lux
+## counts = number of series that read temperature, humidity and lux
+## luxHRs = Cumulative Lux Hours
+## led_state = LED state bit vector from ledStage
+## errors = status of each series, defaults to this cycle's sensor_error
+def collectorStage(now, fused, counts, luxHRs, led_state, errors=None):
+    if errors is None:
+        errors = sensor_error
+    ranges = []
+    for x in range(0,3):
+        if counts[x] == 0:
+            ranges.append((None, None))
+        else:
+            ranges.append((fused[x][0], fused[x][1]))
+    collector_client.send(now, ranges, luxHRs, packBits(errors), led_state)
+
+########################################################################
+# Metrics Stage:                                                       #
+# The cycle's fused values, precision, series status, LED states and   #
+# loop timings are handed to the metrics endpoint as one snapshot. The #
+# endpoint formats and serves it from its own thread, so requests add  #
+# no time to the loop.                                                 #
+########################################################################
+# Returns the cycle's snapshot for the metrics endpoint
+## now = wall-clock time of the readings
+## fused = (low, high, median, precision) of temperature, humidity and lux
+## luxHRs = Cumulative Lux Hours
+## hum_changed = True if humidity changed more than hum_hrch within the hour
+## led_state = LED state bit vector from ledStage
+## timings = dict of loop timings (see metrics.py)
+## errors, down = status and down count of each series, default to this
+##                cycle's sensor_error and sensor_down
+def metricsSnapshot(now, fused, luxHRs, hum_changed, led_state, timings,
+    errors=None, down=None):
+    if errors is None:
+        errors = sensor_error
+    if down is None:
+        down = sensor_down
+    snapshot = {"time": now, "lux_hours": luxHRs,
+        "humidity_changed": int(hum_changed), "loop": timings}
+    for key, (low, high, median, precision) in zip(("temperature", "humidity", "lux"), fused):
+        snapshot[key] = {"low": low, "high": high, "median": median,
+            "precision": precision}
+
+    snapshot["series"] = []
+    for x in range(0,len(series_list)):
+        s = series_list[x]
+        snapshot["series"].append({"series": s.number, "address": hex(s.address),
+            "channel": s.channel, "down": errors[x], "down_cycles": down[x]})
+
+    bits = led_bank.bits(led_state)
+    snapshot["leds"] = [{"led": "L%02d" % (x + 1), "pin": led_list[x], "on": bits[x]}
+        for x in range(0,len(led_list))]
+    # Latest stage timing summary, replaced (never changed) by timingStage
+    snapshot["timing"] = timing.last
+    return snapshot
+
+########################################################################
+# Timing Stage:                                                        #
+# Every stage of the loop, and each series read, is timed into a       #
+# histogram. Once every timing_interval seconds the histograms are     #
+# summarized (p50, p95, p99, max per stage) and started again.         #
+########################################################################
+# Summarizes the stage times if the interval is up
+# Returns the summary, or None if it isn't due yet
+## now = monotonic time
+def timingStage(now):
+    global timing_due
+    if not timing.enabled:
+        return None
+    if timing_due is None:
+        timing_due = now + timing_interval
+    if now < timing_due:
+        return None
+    # Skipping any intervals missed, so summaries stay on the interval grid
+    timing_due = timing_due + timing_interval * (int((now - timing_due) // timing_interval) + 1)
+
+    summary = timing.export()
+    if trace.level <= trace.INFO:
+        lines = ["\nStage times (ms), timing overhead %0.3f%% of the cycle:" %
+            (summary["overhead"] * 100)]
+        for name in summary["stages"]:
+            stage = summary["stages"][name]
+            lines.append("\t%-14s n=%-5d p50 %8.3f  p95 %8.3f  p99 %8.3f  max %8.3f" %
+                (name, stage["count"], stage["p50"] * 1000, stage["p95"] * 1000,
+                stage["p99"] * 1000, stage["max"] * 1000))
+        trace.event(trace.INFO, "timing", "\n".join(lines), **summary)
+    return summary
+
+# Loads the configuration, and creates the hardware backend, LED bank, log
+## writers, collector connection and metrics endpoint
+# Returns the SeriesAcquirer that reads the series
+def startup():
+    global backend, led_bank, log, bin_log, raw_capture, collector_client, metrics_server
+
+    loadConfig()
+    trace.configure(trace_level, ring=trace_ring, path=trace_file, console=(debug == 1))
+    if stage_timing == 1:
+        timing.enable()
+
+    # MUX addresses in use on each I2C bus
+    for s in series_list:
+        bus_addresses.setdefault(s.bus, set()).add(s.address)
+
+    # Instantiates the hardware backend (MUX, sensors and LEDs)
+    backend = hardware.getBackend(sensor_backend, addresses=bus_addresses)
+
+    # Disable all channels for fresh start
+    backend.disableAll()
+    led_bank = LedBank(backend, led_list)
+    led_bank.setup()
+    log = LogWriter(flush_rows=log_flush_rows, flush_interval=log_flush_interval,
+        headers=logHeaders(len(series_list), len(led_list)))
+    if binary_log == 1:
+        from . import binlog
+        bin_log = binlog.BinaryLogWriter(len(series_list), len(led_list),
+            flush_rows=log_flush_rows, flush_interval=log_flush_interval)
+    if raw_log == 1:
+        from . import rawlog
+        raw_capture = rawlog.RawLogWriter(series_list, max_bytes=raw_log_max_mb*1024*1024,
+            flush_rows=log_flush_rows, flush_interval=log_flush_interval)
+    if collector_address:
+        from . import collector
+        collector_client = collector.CollectorClient(collector_address)
+    if metrics_port:
+        from . import metrics
+        metrics_server = metrics.MetricsServer(metrics_port).start()
+    return SeriesAcquirer(backend.readSeries, series_timeout,
+        backend.readSeriesBatch if batch_reads == 1 else None)
+
+# Writes out anything still buffered and closes the log files, collector
+## connection and metrics endpoint
+## acquirer = the SeriesAcquirer from startup()
+def shutdown(acquirer):
+    # Writing out any rows still waiting in the log buffer
+    log.close()
+    if bin_log is not None:
+        bin_log.close()
+    if raw_capture is not None:
+        raw_capture.close()
+    if collector_client is not None:
+        collector_client.close()
+    if metrics_server is not None:
+        metrics_server.stop()
+    acquirer.shutdown()
+    trace.close()
+
+
+# Runs the sensor fusion loop until Ctrl + C
+def main():
+    global count
+
+    acquirer = startup()
+    schedule = FixedRateScheduler(loop_period)
+    laps = timing.Laps()
+    schedule.start()
+    late = 0
+
+    try:
+        while True:
+            # Wall-clock time of this cycle, used for the Lux Hours and
+            ## Humidity windows
+            now = time.time()
+            cycle_start = time.monotonic()
+            laps.start()
+
+            # Sensor Reading Stage
+            readings = acquirer.acquire(series_list)
+            laps.lap("acquire")
+            if raw_capture is not None:
+                raw_capture.write(datetime.now(), readings)
+                laps.lap("raw_log")
+            temp_intervals, hum_intervals, lux_intervals = readStage(readings)
+            laps.lap("read")
+
+            # Marzullo's Algorithm Stage
+            if trace.level <= trace.DEBUG:
+                trace.event(trace.DEBUG, "fuse",
+                    "\nApplying Marzullo's Algorithm returns the following results:")
+            lowL, highL, medianL, luxMA = fuseStage(lux_intervals, 2)
+            luxHRs = luxHoursStage(now, medianL)
+            lowT, highT, medianT, tempMA = fuseStage(temp_intervals, 0)
+            lowH, highH, medianH, humMA = fuseStage(hum_intervals, 1)
+            hum_changed = humidityStage(now, medianH)
+            fused = [(lowT, highT, medianT, tempMA), (lowH, highH, medianH, humMA),
+                (lowL, highL, medianL, luxMA)]
+            laps.lap("fuse")
+
+            # LED/Actuator Driver Stage
+            led_state = ledStage(now, lowT, highT, lowH, highH, lowL, highL, luxHRs,
+                hum_changed)
+            laps.lap("leds")
+
+            # Disabling Channels to ensure fresh start in next loop
+            disableStage(acquirer)
+
+            # Logging Stage
+            logStage(datetime.now(), medianT, medianH, medianL, luxHRs, led_state)
+            laps.lap("log")
+
+            # Collector Stage
+            if collector_client is not None:
+                collectorStage(now, fused, [len(temp_intervals), len(hum_intervals),
+                    len(lux_intervals)], luxHRs, led_state)
+                laps.lap("collector")
+
+            #Increase Loop Count at end of loop
+            count = count + 1
+
+            # Metrics Stage
+            ## The overrun reported is the previous cycle's, this one's is only
+            ## known once the wait below returns
+            if metrics_server is not None:
+                timings = {"period": loop_period,
+                    "cycle_seconds": time.monotonic() - cycle_start,
+                    "late_seconds": late, "cycles": count,
+                    "overruns": schedule.overruns, "missed": schedule.missed}
+                metrics_server.publish(metricsSnapshot(now, fused, luxHRs,
+                    hum_changed, led_state, timings))
+                laps.lap("metrics")
+
+            # Timing Stage
+            laps.total()
+            timingStage(time.monotonic())
+
+            # Waiting for the start of the next cycle
+            ## Sleeps only for the time left in the period, so processing time
+            ## doesn't add to the spacing between log entries
+            late = schedule.wait()
+            if late > 0 and trace.level <= trace.WARN:
+                trace.event(trace.WARN, "loop",
+                    "Cycle overran its %0.1f second period by %0.2f seconds" %
+                    (loop_period, late), period=loop_period, late=late)
+    except KeyboardInterrupt:
+        led_bank.cleanup()
+        print("\n")
+        pass
+    finally:
+        shutdown(acquirer)
+
+
+if __name__ == "__main__":
+    main()
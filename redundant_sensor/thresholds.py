@@ -0,0 +1,127 @@
+# Alert Threshold Rules
+#
+# Every alert LED is described by one rule: which value it watches, whether it
+## triggers above or below a limit, and the limit itself. The rule table is
+## compiled once into numpy arrays, then each cycle every rule is checked in a
+## single vectorized comparison:
+#
+#   bits = sign * values[index] > sign * limit
+#
+## where sign is +1 for '>' rules and -1 for '<' rules. Adding a quantity or a
+## sensor series only adds rows to the table, not code, and the cost of a check
+## stays flat as the table grows.
+# A latching rule stays on once triggered, until the table is reset.
+#
+# To stop readings that hover around a limit from flicking an alert on and off
+## every cycle, each rule can have:
+## band = hysteresis band. Once on, the alert only turns off after the value
+##        has come back past the limit by more than the band.
+## dwell = minimum time, in seconds, the new state has to hold before the
+##         alert actually turns on or off.
+
+import numpy as np
+
+from . import trace
+
+# Comparisons a rule can use, as the sign applied to both sides
+_SIGN = {">": 1, "<": -1}
+
+
+# One alert rule
+## pin = GPIO pin of the LED the rule drives
+## value = name of the input value the rule watches
+## compare = ">" to trigger above the limit, "<" to trigger below it
+## limit = threshold the value is compared against
+## band = distance back past the limit the value has to move to turn off
+## dwell = seconds a change has to hold before the alert follows it
+## latch = True if the alert stays on once triggered
+## message = text printed in debug mode while the alert is on
+class AlertRule:
+
+    def __init__(self, pin, value, compare, limit, band=0, dwell=0, latch=False,
+        message=None):
+        if compare not in _SIGN:
+            raise ValueError("Unknown comparison %s for LED on pin %s" % (compare, pin))
+        self.pin = pin
+        self.value = value
+        self.compare = compare
+        self.limit = limit
+        self.band = band
+        self.dwell = dwell
+        self.latch = latch
+        self.message = message
+
+
+# A compiled table of alert rules
+## rules = list of AlertRule, in LED (and log) order
+## inputs = names of the input values, in the order they are passed to check()
+class ThresholdTable:
+
+    def __init__(self, rules, inputs):
+        self.rules = list(rules)
+        self.inputs = list(inputs)
+
+        position = {}
+        for x in range(0,len(self.inputs)):
+            position[self.inputs[x]] = x
+        for rule in self.rules:
+            if rule.value not in position:
+                raise ValueError("Rule for LED on pin %s watches unknown value %s" % (rule.pin, rule.value))
+
+        self.index = np.array([position[r.value] for r in self.rules], dtype=np.intp)
+        self.sign = np.array([_SIGN[r.compare] for r in self.rules], dtype=float)
+        self.limit = self.sign * np.array([r.limit for r in self.rules], dtype=float)
+        # Limit an alert that is already on has to drop back past to turn off
+        self.release = self.limit - np.array([r.band for r in self.rules], dtype=float)
+        self.dwell = np.array([r.dwell for r in self.rules], dtype=float)
+        self.latch = np.array([r.latch for r in self.rules], dtype=bool)
+        self.reset()
+
+    # Checks every rule against the current input values
+    # Returns a bool array, one entry per rule, True where the alert is on
+    ## values = input values, in the order of 'inputs'
+    ## now = time of the values in seconds, for the dwell times
+    def check(self, values, now=0):
+        values = np.asarray(values, dtype=float)
+        signed = self.sign * values[self.index]
+        wanted = np.where(self.on, signed > self.release, signed > self.limit)
+
+        # Timing how long each alert has wanted to change state
+        changing = wanted != self.on
+        self.since = np.where(changing & np.isnan(self.since), now, self.since)
+        self.since[~changing] = np.nan
+        flip = changing & (now - self.since >= self.dwell)
+        self.on = self.on ^ flip
+        self.since[flip] = np.nan
+        self.changes = self.changes + int(np.count_nonzero(flip))
+
+        bits = self.on | self.latched
+        self.latched = bits & self.latch
+
+        if trace.level <= trace.DEBUG:
+            for x in np.flatnonzero(bits):
+                if self.rules[x].message is not None:
+                    trace.event(trace.DEBUG, "alert", "%s, LED%02d On" %
+                        (self.rules[x].message, x + 1), led="L%02d" % (x + 1),
+                        pin=self.rules[x].pin)
+
+        return bits
+
+    # Turns every alert off and clears any latched alerts
+    def reset(self):
+        # State of each alert before latching, and the time it started
+        ## wanting to change (NaN if it doesn't)
+        self.on = np.zeros(len(self.rules), dtype=bool)
+        self.since = np.full(len(self.rules), np.nan)
+        self.latched = np.zeros(len(self.rules), dtype=bool)
+        # Number of times any alert has turned on or off
+        self.changes = 0
+
+
+# Packs a bool array into an integer bit vector, entry x being bit x
+def packBits(bits):
+    bits = np.asarray(bits, dtype=bool)
+    # packbits fills each byte from its top bit and zero pads the end, so the
+    ## array is packed reversed and the padding shifted back out
+    packed = np.packbits(bits[::-1])
+    return int.from_bytes(packed.tobytes(), "big") >> (-len(bits) % 8)
@@ -0,0 +1,163 @@
+# Stage Timing
+#
+# Times each stage of the loop while it runs, so a slow cycle can be put down
+## to the part that caused it: MUX switching, a sensor driver being set up
+## again, the HTU31D conversion, Marzullo's Algorithm, the GPIO writes or the
+## log write. Sensor reads are timed per series.
+#
+# Each stage has a histogram of its times. Buckets grow by a fixed ratio, so
+## recording a time is a few arithmetic steps whatever its size, and p50, p95
+## and p99 are read back to within that ratio (5%). The max is exact.
+# export() summarizes every stage and starts new histograms, so each summary
+## covers one interval (timing_interval in sensor_fusion.py). The summary is
+## traced at info level and served by the metrics endpoint.
+#
+# Timing is off until enable() is called. The loop times its stages with Laps,
+## one lap per stage, and code inside a stage checks 'enabled' first:
+##
+##   if timing.enabled:
+##       start = time.perf_counter()
+##   ...
+##   if timing.enabled:
+##       timing.record("gpio", time.perf_counter() - start)
+##
+# enable() also measures what one lap costs, and each summary gives the share
+## of the measured cycle time spent timing ("overhead"), which should stay well
+## under 1%.
+
+import math
+import time
+
+# True while stages are being timed
+enabled = False
+# Histogram of each stage, by name
+stages = {}
+# Seconds one timed section (a lap) costs, measured by enable()
+section_cost = 0
+# Summary from the last export(), None before the first
+last = None
+# Name of the stage that covers the whole cycle, used for the overhead
+CYCLE = "cycle"
+
+
+# Histogram of stage times
+## low = smallest time told apart (seconds), anything faster is counted in the
+##       first bucket
+## ratio = growth of each bucket over the one before
+## buckets = number of buckets, anything slower than the last goes in it
+class Histogram:
+
+    def __init__(self, low=1e-6, ratio=1.05, buckets=450):
+        self.low = low
+        self.ratio = ratio
+        self.scale = 1 / math.log(ratio)
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # Adds one time, in seconds
+    def add(self, seconds):
+        if seconds > self.low:
+            x = int(math.log(seconds / self.low) * self.scale) + 1
+            if x >= len(self.counts):
+                x = len(self.counts) - 1
+        else:
+            x = 0
+        self.counts[x] = self.counts[x] + 1
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Returns the time that q (0-1) of the recorded times are at or under, as
+    ## the top of its bucket (never more than the max)
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for x in range(0,len(self.counts)):
+            seen = seen + self.counts[x]
+            if seen >= rank and seen > 0:
+                return min(self.low * self.ratio ** x, self.max)
+        return self.max
+
+    # Returns count, mean, p50, p95, p99 and max as a dict (seconds)
+    def summary(self):
+        return {"count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50), "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99), "max": self.max}
+
+
+# Adds a time to a stage's histogram, creating it on first use
+## name = stage name, e.g. "fuse" or "series1.htu"
+## seconds = time the stage took
+def record(name, seconds):
+    histogram = stages.get(name)
+    if histogram is None:
+        histogram = stages[name] = Histogram()
+    histogram.add(seconds)
+
+
+# Times the stages of a cycle one after another, each lap running from the
+## end of the last one
+class Laps:
+
+    def __init__(self):
+        self.start()
+
+    # Starts a new cycle
+    def start(self):
+        self.first = time.perf_counter()
+        self.last = self.first
+
+    # Records the time since the last lap (or the start) as stage 'name'
+    def lap(self, name):
+        now = time.perf_counter()
+        if enabled:
+            record(name, now - self.last)
+        self.last = now
+
+    # Records the time since the start as the whole cycle
+    def total(self, name=CYCLE):
+        if enabled:
+            record(name, time.perf_counter() - self.first)
+
+
+# Starts timing, with empty histograms, and measures the cost of a lap
+def enable():
+    global enabled, stages, section_cost
+    enabled = True
+    laps = Laps()
+    runs = 2000
+    start = time.perf_counter()
+    for x in range(runs):
+        laps.lap("calibrate")
+    section_cost = (time.perf_counter() - start) / runs
+    stages = {}
+
+
+# Stops timing
+def disable():
+    global enabled
+    enabled = False
+
+
+# Summarizes every stage and starts new histograms for the next interval
+# Returns {"stages": {name: summary}, "overhead": share of the cycle time
+## spent timing, "section_cost": seconds per timed section}
+def export():
+    global stages, last
+    current = stages
+    stages = {}
+    summary = {"stages": {}, "section_cost": section_cost, "overhead": 0.0}
+    sections = 0
+    for name in sorted(current):
+        summary["stages"][name] = current[name].summary()
+        sections = sections + current[name].count
+    if CYCLE in current and current[CYCLE].total > 0:
+        summary["overhead"] = sections * section_cost / current[CYCLE].total
+    last = summary
+    return summary
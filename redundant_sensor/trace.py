@@ -0,0 +1,170 @@
+# Trace Logging
+#
+# Leveled, structured events from every stage of the loop, in place of debug
+## prints. Each event is a dict:
+#
+#   {"time": epoch seconds, "level": "debug", "stage": "fuse",
+#    "message": "Median Temperature is: 21.0 C", <fields of the event>...}
+#
+# Events go to any of three sinks:
+#   ring      the last 'ring' events, kept in memory (see recent(), and /trace
+#             on the metrics endpoint)
+#   file      JSON lines, appended to a file
+#   console   the message printed to the screen, as debug mode always did
+#
+# Levels, from most to least detailed: trace, debug, info, warn, error. Only
+## events at or above 'level' are recorded, and with level "off" none are.
+# A disabled level costs nothing: every call site checks the level before it
+## builds its event, so no message is formatted and no value worked out
+##
+##   if trace.level <= trace.DEBUG:
+##       trace.event(trace.DEBUG, "fuse", "Median Lux is: %0.1f" % median, lux=median)
+##
+## Values that would take extra work to get (like another sensor read) are
+## never traced, the event only carries what the stage already has.
+
+import atexit
+import json
+import threading
+import time
+from collections import deque
+
+# Levels
+TRACE = 5
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {"trace": TRACE, "debug": DEBUG, "info": INFO, "warn": WARN,
+    "error": ERROR, "off": OFF}
+_NAMES = {TRACE: "trace", DEBUG: "debug", INFO: "info", WARN: "warn",
+    ERROR: "error"}
+
+# Lowest level recorded, set with configure()
+level = OFF
+# Sinks events are written to, set with configure()
+sinks = []
+# The ring sink, if there is one, for recent()
+_ring = None
+
+
+# Keeps the last 'size' events in memory
+class RingSink:
+
+    def __init__(self, size):
+        self.events = deque(maxlen=size)
+
+    def write(self, record):
+        self.events.append(record)
+
+    def close(self):
+        pass
+
+
+# Appends events to a file as JSON lines
+## path = file to append to
+## flush_interval = max seconds an event may wait in the file buffer
+class FileSink:
+
+    def __init__(self, path, flush_interval=1):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.file = open(path, "a")
+        # Events can come from the bus worker threads as well as the loop
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line)
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+# Prints each event's message to the screen
+class ConsoleSink:
+
+    def write(self, record):
+        print(record["message"])
+
+    def close(self):
+        pass
+
+
+# Sets the trace level and sinks, closing any sinks set before
+## new_level = lowest level recorded, as a name ("debug") or number (DEBUG)
+## ring = number of recent events kept in memory, 0 for none
+## path = JSON lines file to append events to, None for no file
+## console = True to print events to the screen
+def configure(new_level, ring=1000, path=None, console=False):
+    global level, sinks, _ring
+    if isinstance(new_level, str):
+        if new_level.lower() not in LEVELS:
+            raise ValueError("unknown trace level %s, expected one of %s" %
+                (new_level, ", ".join(LEVELS)))
+        new_level = LEVELS[new_level.lower()]
+
+    close()
+    new_sinks = []
+    _ring = None
+    if new_level < OFF:
+        if ring > 0:
+            _ring = RingSink(ring)
+            new_sinks.append(_ring)
+        if path is not None:
+            new_sinks.append(FileSink(path))
+        if console:
+            new_sinks.append(ConsoleSink())
+    sinks = new_sinks
+    # Set last, so no event is recorded before its sinks are in place
+    level = new_level if new_sinks else OFF
+
+
+# Records an event. Call sites check 'level' first (see above).
+## event_level = level of the event (TRACE to ERROR)
+## stage = stage or module the event comes from
+## message = text of the event, as printed on the console
+## fields = values carried by the event
+def event(event_level, stage, message, **fields):
+    if event_level < level:
+        return
+    record = {"time": time.time(), "level": _NAMES.get(event_level, event_level),
+        "stage": stage, "message": message}
+    record.update(fields)
+    for sink in sinks:
+        sink.write(record)
+
+
+# Returns the events kept in memory, oldest first
+## count = number of most recent events to return, all if None
+def recent(count=None):
+    if _ring is None:
+        return []
+    events = list(_ring.events)
+    if count is not None:
+        events = events[-count:] if count > 0 else []
+    return events
+
+
+# Turns tracing off and closes the sinks
+def close():
+    global level, sinks
+    level = OFF
+    for sink in sinks:
+        sink.close()
+    sinks = []
+
+
+atexit.register(close)
@@ -0,0 +1,137 @@
+# Rolling Time Windows
+#
+# Structures that keep a running result over the most recent stretch of
+## wall-clock time, at a fixed cost per reading no matter how many readings
+## fall inside the window.
+
+from collections import deque
+
+
+# Rolling minimum and maximum over the last 'window' seconds
+# Two monotonic queues of (time, value) pairs are kept: one where values only
+## decrease from front to back (front is the maximum) and one where they only
+## increase (front is the minimum). A new reading removes every reading at the
+## back that it makes irrelevant, then expired readings are dropped from the
+## front. Each reading is added and removed at most once, so add() is
+## amortized O(1) whatever the window length or sample rate.
+## window = length of the window in seconds
+class RollingMinMax:
+
+    def __init__(self, window):
+        self.window = window
+        self.maxq = deque()
+        self.minq = deque()
+
+    # Adds a reading taken at wall-clock time 'now'
+    def add(self, now, value):
+        while self.maxq and self.maxq[-1][1] <= value:
+            self.maxq.pop()
+        self.maxq.append((now, value))
+        while self.minq and self.minq[-1][1] >= value:
+            self.minq.pop()
+        self.minq.append((now, value))
+
+        # Dropping readings older than the window
+        while now - self.maxq[0][0] > self.window:
+            self.maxq.popleft()
+        while now - self.minq[0][0] > self.window:
+            self.minq.popleft()
+
+    # Largest reading in the window (None if empty)
+    def max(self):
+        if not self.maxq:
+            return None
+        return self.maxq[0][1]
+
+    # Smallest reading in the window (None if empty)
+    def min(self):
+        if not self.minq:
+            return None
+        return self.minq[0][1]
+
+    # True if any reading in the window differs from 'value' by more than
+    ## 'threshold'
+    def changed(self, value, threshold):
+        if not self.maxq:
+            return False
+        return (self.maxq[0][1] - value > threshold or
+            value - self.minq[0][1] > threshold)
+
+    # Empties the window
+    def clear(self):
+        self.maxq.clear()
+        self.minq.clear()
+
+
+# Rolling lux-hours total over the last 'window' seconds
+# Each new reading adds the area under the lux curve since the previous one,
+## (previous + current) / 2 * elapsed hours, so the total is correct whatever
+## the loop period and even if cycles overrun. The area is kept in a fixed
+## ring of 'buckets' time slices, and slices are emptied as they fall out of
+## the window, so memory stays the same at any sample rate and the total
+## rolls forward smoothly instead of resetting.
+# The window edge moves one slice at a time, so the oldest slice_width seconds
+## may be partly counted.
+## window = length of the window in seconds
+## buckets = number of time slices the window is split into
+class LuxHoursIntegrator:
+
+    def __init__(self, window=24 * 60 * 60, buckets=1440):
+        self.window = window
+        self.buckets = buckets
+        self.slice_width = window / buckets
+        self.clear()
+
+    # Adds a lux reading taken at wall-clock time 'now'
+    def add(self, now, lux):
+        if self.last_time is not None and now > self.last_time:
+            # Only the part of the gap inside the window can still count
+            start = max(self.last_time, now - self.window)
+            area = (self.last_lux + lux) / 2 * (now - start) / 3600
+            self._advance(int(now // self.slice_width))
+
+            # Sharing the area between the slices the gap covers
+            rate = area / (now - start)
+            first = max(int(start // self.slice_width), self.head - self.buckets + 1)
+            for index in range(first, self.head + 1):
+                low = max(start, index * self.slice_width)
+                high = min(now, (index + 1) * self.slice_width)
+                if high > low:
+                    part = rate * (high - low)
+                    self.slices[index % self.buckets] += part
+                    self.total = self.total + part
+        elif self.last_time is None:
+            self.head = int(now // self.slice_width)
+
+        if self.last_time is None or now >= self.last_time:
+            self.last_time = now
+            self.last_lux = lux
+
+    # Moves the newest slice up to 'head', emptying slices that leave the window
+    def _advance(self, head):
+        if head <= self.head:
+            return
+        if head - self.head >= self.buckets:
+            self.slices = [0.0] * self.buckets
+            self.total = 0.0
+        else:
+            for index in range(self.head + 1, head + 1):
+                slot = index % self.buckets
+                self.total = self.total - self.slices[slot]
+                self.slices[slot] = 0.0
+            # Guarding against rounding drift below zero
+            if self.total < 0:
+                self.total = 0.0
+        self.head = head
+
+    # Lux hours within the window
+    def value(self):
+        return self.total
+
+    # Empties the window
+    def clear(self):
+        self.slices = [0.0] * self.buckets
+        self.total = 0.0
+        self.head = None
+        self.last_time = None
+        self.last_lux = 0.0